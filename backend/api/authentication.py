@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.cache import token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, читающий пользователя из кэша снимков.
+
+    К базе обращается только при промахе. Снимки сбрасываются при
+    удалении токена (выход через djoser) и изменении пользователя,
+    в том числе деактивации. TOKEN_CACHE_TIMEOUT=0 отключает кэш.
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.TOKEN_CACHE_TIMEOUT:
+            return super().authenticate_credentials(key)
+        user = token_cache.get(key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user)
+            return user, token
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, Token(key=key, user=user)
@@ -0,0 +1,106 @@
+import base64
+import binascii
+import re
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+from core.constants import IMAGE_DECODE_CHUNK
+from recipes.images import is_variant_of
+
+BASE64_HEADER = ';base64,'
+BASE64_HEADER_SEARCH = 256
+BASE64_SKIPPED = re.compile(r'[^A-Za-z0-9+/=]')
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    """Поле фото в base64, декодируемое частями во временный файл.
+
+    В отличие от Base64ImageField не создаёт в памяти копий
+    всего файла: данные декодируются блоками, а крупные файлы
+    уходят на диск (FILE_UPLOAD_MAX_MEMORY_SIZE). Символы вне алфавита
+    base64 (например, переносы строк MIME) пропускаются, а блоки
+    декодируются по границе четверок символов.
+    """
+
+    @staticmethod
+    def decode_chunks(base64_data, start):
+        pending = ''
+        for offset in range(start, len(base64_data), IMAGE_DECODE_CHUNK):
+            pending += BASE64_SKIPPED.sub(
+                '', base64_data[offset:offset + IMAGE_DECODE_CHUNK]
+            )
+            aligned = len(pending) - len(pending) % 4
+            yield base64.b64decode(pending[:aligned], validate=True)
+            pending = pending[aligned:]
+        if pending:
+            yield base64.b64decode(pending, validate=True)
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        content_type = None
+        start = base64_data.find(BASE64_HEADER, 0, BASE64_HEADER_SEARCH)
+        if start == -1:
+            start = 0
+        else:
+            content_type = base64_data[:start].replace('data:', '')
+            start += len(BASE64_HEADER)
+        file = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        try:
+            for chunk in self.decode_chunks(base64_data, start):
+                file.write(chunk)
+            file.seek(0)
+            with Image.open(file) as image:
+                extension = image.format.lower()
+                image.verify()
+        except (binascii.Error, ValueError, OSError):
+            file.close()
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        extension = 'jpg' if extension == 'jpeg' else extension
+        if extension not in self.ALLOWED_TYPES:
+            file.close()
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        file.seek(0, 2)
+        size = file.tell()
+        file.seek(0)
+        return serializers.FileField.to_internal_value(self, UploadedFile(
+            file=file,
+            name=f'{uuid.uuid4()}.{extension}',
+            content_type=content_type if self.trust_provided_content_type
+            else None,
+            size=size
+        ))
+
+
+class ImageVariantField(serializers.ReadOnlyField):
+    """Ссылка на вариант фото рецепта.
+
+    Пока вариант не построен или устарел, отдаётся исходное фото.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        variant = getattr(recipe, self.variant)
+        file = variant if is_variant_of(variant, recipe.image) else (
+            recipe.image
+        )
+        if not file:
+            return None
+        request = self.context.get('request')
+        if request is None:
+            return file.url
+        return request.build_absolute_uri(file.url)
@@ -1,5 +1,8 @@
+from django.db.models import Case, IntegerField, Value, When
 from django_filters import rest_framework as filters
 
+from core.constants import (INGREDIENT_SEARCH_LIMIT, MATCH_ALL, MATCH_ANY,
+                            MATCH_MOST, RANKING_POPULAR, RANKING_TRENDING)
 from recipes.models import Ingredient, Recipe, Tag
 
 
@@ -10,7 +13,13 @@ class SearchIngredientsFilter(filters.FilterSet):
     )
 
     def filter_name(self, queryset, name, value):
-        return queryset.filter(name__istartswith=value.lower())
+        return queryset.filter(name__icontains=value).annotate(
+            match_rank=Case(
+                When(name__istartswith=value, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        ).order_by('match_rank', 'name')[:INGREDIENT_SEARCH_LIMIT]
 
     class Meta:
 
@@ -18,6 +27,10 @@ class SearchIngredientsFilter(filters.FilterSet):
         fields = ('name',)
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
 class RecipeFilter(filters.FilterSet):
 
     tags = filters.ModelMultipleChoiceFilter(
@@ -31,6 +44,27 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    ingredients = NumberInFilter(
+        method='filter_ingredients'
+    )
+    match = filters.ChoiceFilter(
+        choices=(
+            (MATCH_ALL, 'Все ингредиенты'),
+            (MATCH_ANY, 'Хотя бы один ингредиент'),
+            (MATCH_MOST, 'Большинство ингредиентов'),
+        ),
+        method='filter_match'
+    )
+    search = filters.CharFilter(
+        method='filter_search'
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(
+            (RANKING_POPULAR, 'Популярные'),
+            (RANKING_TRENDING, 'Набирающие популярность'),
+        ),
+        method='filter_ordering'
+    )
 
     class Meta:
 
@@ -42,6 +76,11 @@ class RecipeFilter(filters.FilterSet):
             'is_in_shopping_cart'
         )
 
+    def filter_queryset(self, queryset):
+        return super().filter_queryset(queryset).order_by_relevance(
+            self.form.cleaned_data.get('ordering')
+        )
+
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(
@@ -55,3 +94,17 @@ class RecipeFilter(filters.FilterSet):
                 shopping_list__author=self.request.user,
             )
         return queryset
+
+    def filter_ingredients(self, queryset, name, value):
+        return queryset.with_ingredients(
+            value, self.form.cleaned_data.get('match') or MATCH_ALL
+        )
+
+    def filter_match(self, queryset, name, value):
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        return queryset.search(value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.ranked(value)
@@ -0,0 +1,488 @@
+import itertools
+import json
+import statistics
+import textwrap
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.renders import SHOPPING_CART_RENDERERS
+from core.constants import (BENCHMARK_BASELINE, BENCHMARK_CONCURRENCY,
+                            BENCHMARK_DURATION, BENCHMARK_HTTP_TIMEOUT,
+                            BENCHMARK_RENDER_BUDGET, BENCHMARK_RENDER_LINES,
+                            BENCHMARK_REPEAT, BENCHMARK_SEARCH_BUDGET,
+                            BENCHMARK_TOLERANCE, MATCH_ALL, MATCH_ANY,
+                            MATCH_MOST, PAGE_SIZE, RANKING_POPULAR,
+                            RANKING_TRENDING)
+from core.metrics import RequestMetrics, percentile
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            Shopping_Cart, Tag)
+from users.models import User, UserSubscribe
+
+
+class Command(BaseCommand):
+    help = 'Замеряет производительность узких мест API'
+
+    suites = ('renders', 'explain', 'search', 'filters', 'detail',
+              'subscriptions', 'ingredients', 'download', 'throughput')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'suites',
+            nargs='*',
+            help=f'Наборы замеров: {", ".join(self.suites)}. '
+                 'По умолчанию запускаются все.'
+        )
+        parser.add_argument(
+            '--seed',
+            action='store_true',
+            help='Перед замерами заполнить базу командой seed_data.'
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='EXPLAIN ANALYZE вместо EXPLAIN (только PostgreSQL).'
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=100000,
+            help='Число рецептов для --seed.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=BENCHMARK_REPEAT,
+            help='Повторов каждого запроса API для оценки времени.'
+        )
+        parser.add_argument(
+            '--baseline',
+            default=settings.BASE_DIR / BENCHMARK_BASELINE,
+            type=Path,
+            help='JSON с базовыми замерами API для поиска регрессий.'
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Сохранить замеры API как базовые вместо сравнения.'
+        )
+        parser.add_argument(
+            '--url',
+            action='append',
+            default=[],
+            help='Адрес запущенного сервера для набора throughput, '
+                 'например http://127.0.0.1:8000. Укажите несколько, '
+                 'чтобы сравнить WSGI и ASGI на одной базе.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=BENCHMARK_CONCURRENCY,
+            help='Число одновременных клиентов набора throughput.'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=BENCHMARK_DURATION,
+            help='Длительность нагрузки на каждый сервер в секундах.'
+        )
+
+    def handle(self, *args, **options):
+        suites = options['suites'] or self.suites
+        unknown = set(suites) - set(self.suites)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные наборы замеров: {", ".join(sorted(unknown))}'
+            )
+        if options['seed']:
+            call_command('seed_data', recipes=options['recipes'],
+                         stdout=self.stdout)
+        self.results = {}
+        self.baseline = {}
+        if options['baseline'].exists():
+            self.baseline = json.loads(options['baseline'].read_text())
+        failed = []
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        with override_settings(ALLOWED_HOSTS=hosts):
+            for suite in suites:
+                self.stdout.write(f'Набор {suite}:')
+                failed += getattr(self, f'bench_{suite}')(options)
+        if options['save_baseline'] and self.results:
+            options['baseline'].write_text(json.dumps(
+                {**self.baseline, **self.results}, indent=2, sort_keys=True
+            ))
+            self.stdout.write(
+                f'Базовые замеры записаны в {options["baseline"]}'
+            )
+        if failed:
+            raise CommandError(
+                f'Не пройдены замеры: {", ".join(failed)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Все замеры уложились в бюджет.'))
+
+    def bench_renders(self, options):
+        """Рендер списка покупок из BENCHMARK_RENDER_LINES строк."""
+        ingredients = [
+            {
+                'name': f'Ингредиент {index}',
+                'measurement_unit': 'г',
+                'amount': index
+            }
+            for index in range(BENCHMARK_RENDER_LINES)
+        ]
+        failed = []
+        for renderer_class in SHOPPING_CART_RENDERERS:
+            renderer = renderer_class()
+            started = time.perf_counter()
+            size = sum(
+                len(chunk) for chunk in renderer.render_lines(ingredients)
+            )
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'  {renderer.format}: {elapsed:.3f} c, размер {size}'
+            )
+            if elapsed > BENCHMARK_RENDER_BUDGET:
+                failed.append(f'renders.{renderer.format}')
+        return failed
+
+    def bench_explain(self, options):
+        """Планы горячих запросов.
+
+        Запустите до и после migrate, чтобы сравнить планы с индексами.
+        """
+        user = User.objects.order_by('-followers_count').first()
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        if user is None or recipe is None:
+            self.stdout.write('  Нет данных: запустите seed_data или --seed.')
+            return []
+        ingredient_ids = list(RecipeIngredient.objects.filter(
+            recipes=recipe
+        ).values_list('ingredients', flat=True)[:3])
+        queries = {
+            'favorite_exists': Favorite.objects.filter(
+                author=user, recipe=recipe
+            )[:1],
+            'shopping_cart_exists': Shopping_Cart.objects.filter(
+                author=user, recipe=recipe
+            )[:1],
+            'recipe_list': Recipe.objects.all()[:PAGE_SIZE],
+            'recipe_list_popular': Recipe.objects.ranked(
+                RANKING_POPULAR
+            )[:PAGE_SIZE],
+            'is_favorited_filter': Recipe.objects.filter(
+                favorites__author=user
+            )[:PAGE_SIZE],
+            'is_in_shopping_cart_filter': Recipe.objects.filter(
+                shopping_list__author=user
+            )[:PAGE_SIZE],
+            'author_recipes': Recipe.objects.filter(
+                author=recipe.author_id
+            )[:PAGE_SIZE],
+            'subscriptions': UserSubscribe.objects.filter(
+                follower=user
+            )[:PAGE_SIZE],
+            'shopping_list': RecipeIngredient.objects.shopping_list(user),
+            'ingredients_all': Recipe.objects.with_ingredients(
+                ingredient_ids, MATCH_ALL
+            )[:PAGE_SIZE],
+            'ingredients_most': Recipe.objects.with_ingredients(
+                ingredient_ids, MATCH_MOST
+            )[:PAGE_SIZE],
+        }
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        for name, queryset in queries.items():
+            self.stdout.write(f'  {name}:')
+            self.stdout.write(
+                textwrap.indent(queryset.explain(**explain_options), '    ')
+            )
+        return []
+
+    def bench_search(self, options):
+        """Поиск рецептов: по словам, фразе и с опечаткой."""
+        if connection.vendor != 'postgresql':
+            self.stdout.write('  Поиск работает только на PostgreSQL.')
+            return []
+        self.stdout.write(f'  Рецептов в базе: {Recipe.objects.count()}')
+        failed = []
+        for term in ('борщ', 'домашний пирог с грибами', '"острый суп"',
+                     'запеканка -сыр', 'барщ', 'пельмени'):
+            started = time.perf_counter()
+            queryset = Recipe.objects.search(term)
+            count = queryset.count()
+            page = list(queryset[:PAGE_SIZE])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'  {term!r}: {elapsed:.3f} c, найдено {count}, '
+                f'на странице {len(page)}'
+            )
+            if elapsed > BENCHMARK_SEARCH_BUDGET:
+                failed.append(f'search.{term}')
+        return failed
+
+    def get_client(self):
+        """Клиент API от имени самого активного пользователя."""
+        user = User.objects.annotate(
+            activity=(Count('favorites', distinct=True)
+                      + Count('followers', distinct=True))
+        ).order_by('-activity', 'id').first()
+        if user is None or not Recipe.objects.exists():
+            return None, None
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client, user
+
+    @staticmethod
+    def fetch(client, url):
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, suite, name, client, url, options):
+        """Время, число SQL и пик выделенной памяти запроса url.
+
+        Возвращает имя замера, если он хуже базового больше чем
+        на BENCHMARK_TOLERANCE или дает больше SQL-запросов.
+        """
+        key = f'{suite}.{name}'
+        response = self.fetch(client, url)
+        if response.status_code != 200:
+            self.stdout.write(f'  {name}: статус {response.status_code}')
+            return [key]
+        latencies = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            self.fetch(client, url)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        queries = RequestMetrics()
+        with connection.execute_wrapper(queries.execute_wrapper):
+            self.fetch(client, url)
+        tracemalloc.start()
+        try:
+            self.fetch(client, url)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result = {
+            'median_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'queries': queries.queries,
+            'alloc_kib': round(peak / 1024, 1),
+        }
+        self.results[key] = result
+        baseline = self.baseline.get(key)
+        regressions = []
+        if baseline and not options['save_baseline']:
+            limit = 1 + BENCHMARK_TOLERANCE
+            if result['median_ms'] > baseline['median_ms'] * limit:
+                regressions.append('время')
+            if result['queries'] > baseline['queries']:
+                regressions.append('SQL')
+            if result['alloc_kib'] > baseline['alloc_kib'] * limit:
+                regressions.append('память')
+        self.stdout.write(
+            f'  {name}: медиана {result["median_ms"]:.1f} мс, '
+            f'p95 {result["p95_ms"]:.1f} мс, SQL {result["queries"]}, '
+            f'память {result["alloc_kib"]:.0f} КиБ'
+            + (f' - регрессия: {", ".join(regressions)}'
+               if regressions else '')
+        )
+        return [key] if regressions else []
+
+    def measure_urls(self, suite, urls, options):
+        client, _ = self.get_client()
+        if client is None:
+            self.stdout.write('  Нет данных: запустите seed_data или --seed.')
+            return []
+        failed = []
+        for name, url in urls.items():
+            failed += self.measure(suite, name, client, url, options)
+        return failed
+
+    def bench_filters(self, options):
+        """Список рецептов со всеми сочетаниями фильтров RecipeFilter."""
+        _, user = self.get_client()
+        if user is None:
+            self.stdout.write('  Нет данных: запустите seed_data или --seed.')
+            return []
+        author = User.objects.order_by('-recipes_count').first()
+        slugs = Tag.objects.values_list('slug', flat=True)[:2]
+        ingredient_ids = ','.join(map(str, Ingredient.objects.annotate(
+            usage=Count('recipeingredient')
+        ).order_by('-usage').values_list('id', flat=True)[:3]))
+        filters = {
+            'tags': '&'.join(f'tags={slug}' for slug in slugs),
+            'author': f'author={author.id}',
+            'is_favorited': 'is_favorited=1',
+            'is_in_shopping_cart': 'is_in_shopping_cart=1',
+        }
+        urls = {}
+        for size in range(len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                query = '&'.join(filters[name] for name in names)
+                urls['+'.join(names) or 'all'] = f'/api/recipes/?{query}'
+        for match in (MATCH_ALL, MATCH_ANY, MATCH_MOST):
+            urls[f'ingredients_{match}'] = (
+                f'/api/recipes/?ingredients={ingredient_ids}&match={match}'
+            )
+        if connection.vendor == 'postgresql':
+            urls['search'] = '/api/recipes/?search=домашний борщ'
+        urls['cursor'] = '/api/recipes/?cursor='
+        for ordering in (RANKING_POPULAR, RANKING_TRENDING):
+            urls[ordering] = f'/api/recipes/?ordering={ordering}'
+            urls[f'{ordering}_cursor'] = (
+                f'/api/recipes/?ordering={ordering}&cursor='
+            )
+        return self.measure_urls('filters', urls, options)
+
+    def bench_detail(self, options):
+        """Страница рецепта: самого популярного и обычного."""
+        popular = Recipe.objects.order_by('-favorites_count').first()
+        regular = Recipe.objects.order_by('favorites_count').first()
+        if popular is None:
+            self.stdout.write('  Нет данных: запустите seed_data или --seed.')
+            return []
+        return self.measure_urls('detail', {
+            'popular': f'/api/recipes/{popular.id}/',
+            'regular': f'/api/recipes/{regular.id}/',
+        }, options)
+
+    def bench_subscriptions(self, options):
+        """Подписки с превью рецептов и лента."""
+        return self.measure_urls('subscriptions', {
+            'subscriptions': '/api/users/subscriptions/',
+            'subscriptions_limit': '/api/users/subscriptions/?recipes_limit=3',
+            'feed': '/api/recipes/feed/',
+        }, options)
+
+    def bench_ingredients(self, options):
+        """Автодополнение ингредиентов."""
+        return self.measure_urls('ingredients', {
+            'all': '/api/ingredients/',
+            'prefix_short': '/api/ingredients/?name=с',
+            'prefix': '/api/ingredients/?name=сах',
+            'substring': '/api/ingredients/?name=ов',
+        }, options)
+
+    def bench_download(self, options):
+        """Скачивание списка покупок во всех форматах."""
+        return self.measure_urls('download', {
+            renderer.format: (
+                f'/api/recipes/download_shopping_cart/'
+                f'?format={renderer.format}'
+            )
+            for renderer in SHOPPING_CART_RENDERERS
+        }, options)
+
+    @staticmethod
+    def run_http_client(url, paths, headers, deadline):
+        """Запросы по кругу до deadline на одном keep-alive соединении.
+
+        Возвращает задержки успешных ответов в мс и число ошибок.
+        """
+        address = urlsplit(url)
+        prefix = address.path.rstrip('/')
+        connection = None
+        latencies = []
+        errors = 0
+        for path in itertools.cycle(paths):
+            if time.perf_counter() >= deadline:
+                break
+            started = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = HTTPConnection(
+                        address.hostname, address.port or 80,
+                        timeout=BENCHMARK_HTTP_TIMEOUT
+                    )
+                connection.request('GET', prefix + path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.will_close:
+                    connection.close()
+                    connection = None
+                success = response.status == 200
+            except (OSError, HTTPException):
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                success = False
+            if success:
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                errors += 1
+        if connection is not None:
+            connection.close()
+        return latencies, errors
+
+    def bench_throughput(self, options):
+        """Пропускная способность запущенных серверов.
+
+        --concurrency клиентов в потоках по кругу запрашивают список
+        и страницу рецепта, теги и поиск ингредиентов. Запустите
+        проект под gunicorn (WSGI) и под uvicorn-воркерами (ASGI)
+        на одной базе и передайте оба адреса в --url.
+        """
+        if not options['url']:
+            self.stdout.write('  Укажите адреса запущенных серверов в --url.')
+            return []
+        _, user = self.get_client()
+        if user is None:
+            self.stdout.write('  Нет данных: запустите seed_data или --seed.')
+            return []
+        token = Token.objects.get(user=user)
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        paths = [
+            '/api/recipes/',
+            f'/api/recipes/{recipe.id}/',
+            '/api/tags/',
+            '/api/ingredients/?' + urlencode({'name': 'са'}),
+        ]
+        headers = {'Authorization': f'Token {token.key}'}
+        concurrency = options['concurrency']
+        first_rate = None
+        for url in options['url']:
+            deadline = time.perf_counter() + options['duration']
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(
+                    lambda index: self.run_http_client(
+                        url, paths[index % len(paths):]
+                        + paths[:index % len(paths)], headers, deadline
+                    ),
+                    range(concurrency)
+                ))
+            elapsed = time.perf_counter() - started
+            latencies = sorted(itertools.chain.from_iterable(
+                latencies for latencies, _ in results
+            ))
+            errors = sum(errors for _, errors in results)
+            rate = len(latencies) / elapsed
+            if first_rate is None:
+                first_rate = rate
+            summary = (
+                f'  {url}: {rate:.0f} запр/с, ответов {len(latencies)}, '
+                f'ошибок {errors}'
+            )
+            if latencies:
+                summary += ', ' + ', '.join(
+                    f'p{percent} {percentile(latencies, percent):.0f} мс'
+                    for percent in (50, 95, 99)
+                )
+            if url != options['url'][0] and first_rate:
+                summary += f', x{rate / first_rate:.2f} к первому'
+            self.stdout.write(summary)
+        return []
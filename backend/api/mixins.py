@@ -0,0 +1,173 @@
+import functools
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.serializers import BulkIdsSerializer
+from core.cache import get_version
+from core.db import run_sync
+from core.metrics import current_metrics
+from core.prometheus import record_cache
+
+
+def render_view(view, request, *args, **kwargs):
+    """Вызывает view и рендерит ответ в том же потоке."""
+    response = view(request, *args, **kwargs)
+    if callable(getattr(response, 'render', None)):
+        started = time.perf_counter()
+        response.render()
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.render_time += time.perf_counter() - started
+    return response
+
+
+class AsyncReadMixin:
+    """Асинхронные view для чтения под ASGI.
+
+    С настройкой ASYNC_READ_VIEWS действия из async_actions
+    выполняются в пуле потоков core.db, а не в единственном потоке
+    синхронного кода, который Django 3.2 отдает всем sync view
+    под ASGI: медленный запрос к базе не задерживает остальные.
+    Другие действия работают как обычные синхронные view.
+    """
+
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not (settings.ASYNC_READ_VIEWS
+                and set(actions.values()) & set(cls.async_actions)):
+            return view
+        sync_view = sync_to_async(view, thread_sensitive=True)
+
+        @functools.wraps(view)
+        async def async_view(request, *args, **kwargs):
+            method = 'get' if request.method == 'HEAD' else (
+                request.method.lower()
+            )
+            if actions.get(method) in cls.async_actions:
+                return await run_sync(render_view, view, request,
+                                      *args, **kwargs)
+            return await sync_view(request, *args, **kwargs)
+
+        return async_view
+
+
+class VersionedCacheMixin:
+    """Кэширует ответы справочников по версии таблицы.
+
+    ETag строится из версии таблицы и полного пути запроса, поэтому
+    на условный запрос 304 отдается без обращения к базе данных
+    и сериализаторам, а готовые байты ответа хранятся в кэше Django.
+    Last-Modified - время версии; If-Modified-Since проверяется,
+    только если клиент не прислал If-None-Match.
+    """
+
+    def get_cache_headers(self, request):
+        version = get_version(self.queryset.model)
+        etag = hashlib.md5(
+            f'{version}:{request.get_full_path()}'.encode()
+        ).hexdigest()
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': (
+                f'public, max-age={settings.REFERENCE_CACHE_MAX_AGE}'
+            ),
+        }
+        if version:
+            headers['Last-Modified'] = http_date(version // 10 ** 9)
+        return headers
+
+    def is_not_modified(self, request, headers):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or headers['ETag'] in etags
+        if 'Last-Modified' not in headers:
+            return False
+        if_modified_since = parse_http_date_safe(
+            request.headers.get('If-Modified-Since', '')
+        )
+        return (if_modified_since is not None
+                and if_modified_since >= parse_http_date_safe(
+                    headers['Last-Modified']
+                ))
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        headers = self.get_cache_headers(request)
+        if self.is_not_modified(request, headers):
+            record_cache('response', True)
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            response = handler(request, *args, **kwargs)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+        key = f'response:{headers["ETag"]}'
+        content = cache.get(key)
+        record_cache('response', content is not None)
+        if content is None:
+            response = handler(request, *args, **kwargs)
+            content = renderer.render(
+                response.data,
+                request.accepted_media_type,
+                self.get_renderer_context()
+            )
+            cache.set(key, content, settings.REFERENCE_CACHE_TIMEOUT)
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        return HttpResponse(content, content_type=content_type,
+                            headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class BulkRelationMixin:
+    """Пакетное добавление и удаление связей текущего пользователя.
+
+    Все id проверяются одним запросом, запись выполняется одним
+    INSERT или DELETE через менеджер связи с методами add и remove.
+    """
+
+    def bulk_relation(self, request, targets, relation, forbidden=()):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        found = set(
+            targets.filter(id__in=ids).values_list('id', flat=True)
+        )
+        allowed = [pk for pk in ids if pk in found and pk not in forbidden]
+        if request.method == 'POST':
+            changed = set(relation.add(request.user, allowed))
+            done, skipped = 'created', 'exists'
+        else:
+            changed = set(relation.remove(request.user, allowed))
+            done, skipped = 'deleted', 'missing'
+        results = []
+        for pk in ids:
+            if pk not in found:
+                result = 'not_found'
+            elif pk in forbidden:
+                result = 'forbidden'
+            else:
+                result = done if pk in changed else skipped
+            results.append({'id': pk, 'status': result})
+        return Response({'results': results})
@@ -1,9 +1,239 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from core.cache import get_author_feed_versions, get_feed_version
 from core.constants import PAGE_PARAM, PAGE_SIZE
+from core.prometheus import record_cache
+from users.models import UserSubscribe
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, кэширующий COUNT(*) на PAGINATION_COUNT_CACHE_TIMEOUT."""
+
+    @cached_property
+    def count(self):
+        timeout = settings.PAGINATION_COUNT_CACHE_TIMEOUT
+        if not timeout or not hasattr(self.object_list, 'query'):
+            return super().count
+        try:
+            sql, params = self.object_list.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'count:' + hashlib.md5(f'{sql}:{params}'.encode()).hexdigest()
+        count = cache.get(key)
+        record_cache('count', count is not None)
+        if count is None:
+            count = Paginator.count.func(self)
+            cache.set(key, count, timeout)
+        return count
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация по уникальному набору полей сортировки.
+
+    Вместо OFFSET и COUNT(*) страница выбирается условием
+    (pub_date, id) < (pub_date, id) последней записи предыдущей страницы,
+    поэтому глубокие страницы стоят столько же, сколько первая.
+    Поля сортировки могут быть полями связанной модели: score__popular,
+    и аннотациями запроса: search_rank, coverage.
+
+    Набор полей - сортировка queryset, если она заканчивается первичным
+    ключом (ее задают фильтры релевантности и рейтинга), иначе
+    cursor_ordering представления.
+    """
+
+    page_size = PAGE_SIZE
+    page_size_query_param = PAGE_PARAM
+    cursor_query_param = 'cursor'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param, '')
+        if page_size.isdigit() and int(page_size) > 0:
+            return int(page_size)
+        return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            reverse, *values = json.loads(base64.urlsafe_b64decode(encoded))
+            if len(values) != len(self.ordering):
+                raise ValueError(self.invalid_cursor_message)
+            position = [
+                self.get_field(field).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), position
+
+    def get_ordering(self, queryset, view):
+        ordering = tuple(queryset.query.order_by)
+        if (ordering and all(isinstance(field, str) for field in ordering)
+                and ordering[-1].lstrip('-') == queryset.model._meta.pk.name):
+            return ordering
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def get_field(self, field):
+        if field.lstrip('-') in self.annotations:
+            return self.annotations[field.lstrip('-')].output_field
+        model = self.model
+        *relations, name = field.lstrip('-').split(LOOKUP_SEP)
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name)
+
+    def get_value(self, obj, field):
+        if field.lstrip('-') in self.annotations:
+            return getattr(obj, field.lstrip('-'))
+        *relations, _ = field.lstrip('-').split(LOOKUP_SEP)
+        for relation in relations:
+            obj = getattr(obj, relation)
+        return self.get_field(field).value_to_string(obj)
+
+    def encode_cursor(self, obj, reverse):
+        values = [self.get_value(obj, field) for field in self.ordering]
+        encoded = base64.urlsafe_b64encode(
+            json.dumps([reverse, *values]).encode()
+        ).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded
+        )
+
+    def get_keyset_filter(self, ordering, position):
+        keyset_filter = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            keyset_filter |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return keyset_filter
+
+    def setup(self, queryset, request, view):
+        self.ordering = self.get_ordering(queryset, view)
+        self.model = queryset.model
+        self.annotations = queryset.query.annotations
+        self.base_url = request.build_absolute_uri()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.setup(queryset, request, view)
+        page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(request)
+        ordering = self.ordering
+        if reverse:
+            ordering = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(ordering, position)
+            )
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+        self.has_next = position is not None if reverse else has_more
+        self.has_previous = has_more if reverse else position is not None
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': (self.encode_cursor(self.page[-1], False)
+                     if self.has_next and self.page else None),
+            'previous': (self.encode_cursor(self.page[0], True)
+                         if self.has_previous and self.page else None),
+            'results': data,
+        })
+
+
+class FeedPagination(KeysetPagination):
+    """Курсорная пагинация ленты с кэшем первой страницы.
+
+    Кэшируются только id рецептов первой страницы, поэтому флаги
+    избранного и данные рецептов всегда актуальны. Ключ кэша включает
+    версию подписок читателя и версии публикаций авторов из подписок:
+    подписка и отписка сбрасывают одну версию читателя, публикация -
+    одну версию автора, сколько бы у него ни было подписчиков.
+    """
+
+    def get_author_ids(self, user_id, version):
+        """id авторов из подписок, кэш сбрасывается вместе с версией."""
+        key = f'feed:authors:{user_id}:{version}'
+        author_ids = cache.get(key)
+        if author_ids is None:
+            author_ids = list(UserSubscribe.objects.filter(
+                follower=user_id
+            ).values_list('author', flat=True))
+            cache.set(key, author_ids, settings.FEED_CACHE_TIMEOUT)
+        return author_ids
+
+    def get_cache_key(self, request, page_size):
+        user_id = request.user.id
+        version = get_feed_version(user_id)
+        authors = sorted(get_author_feed_versions(
+            self.get_author_ids(user_id, version)
+        ).items())
+        digest = hashlib.md5(json.dumps(authors).encode()).hexdigest()
+        return f'feed:{user_id}:{version}:{digest}:{page_size}'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        timeout = settings.FEED_CACHE_TIMEOUT
+        if not timeout or self.cursor_query_param in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        key = self.get_cache_key(request, self.get_page_size(request))
+        cached = cache.get(key)
+        record_cache('feed', cached is not None)
+        if cached is None:
+            page = super().paginate_queryset(queryset, request, view)
+            cache.set(key, ([obj.pk for obj in page], self.has_next),
+                      timeout)
+            return page
+        ids, self.has_next = cached
+        self.has_previous = False
+        self.setup(queryset, request, view)
+        objects = queryset.in_bulk(ids)
+        self.page = [objects[pk] for pk in ids if pk in objects]
+        return self.page
 
 
 class PageNumberAndLimitPagination(PageNumberPagination):
+    """Постраничная пагинация с переходом на курсорную по ?cursor=."""
 
     page_size = PAGE_SIZE
     page_size_query_param = PAGE_PARAM
+    django_paginator_class = CachedCountPaginator
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        cursor_param = self.keyset_pagination_class.cursor_query_param
+        if cursor_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,29 +1,140 @@
+import csv
 import io
-from collections import defaultdict
+import json
+from functools import lru_cache
 
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
 from rest_framework import renderers
 
+from core.constants import PDF_FONT_SIZE, PDF_LEADING, PDF_MARGIN
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    """Метрики в текстовом формате Prometheus."""
+
+    media_type = 'text/plain'
+    format = 'prometheus'
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data.encode(self.charset)
+
 
 class ShoppingCartDataRenderer(renderers.BaseRenderer):
+    """Список покупок в текстовом виде.
+
+    Рендереры списка покупок получают уже агрегированные строки
+    (name, measurement_unit, amount) и отдают файл частями,
+    поэтому подходят для StreamingHttpResponse.
+    """
 
     media_type = 'text/plain'
     format = 'txt'
+    line_template = '• {name} ({measurement_unit}) - {amount}\n'
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    def render_lines(self, ingredients):
+        """Построчно отдает уже агрегированный список покупок."""
+        for ingredient in ingredients:
+            yield self.line_template.format(
+                name=ingredient['name'],
+                measurement_unit=ingredient['measurement_unit'],
+                amount=ingredient['amount']
+            )
 
     def render(self, data, accepted_media_type=None, renderer_context=None):
-        text_buffer = io.StringIO()
-        unique_data = defaultdict(int)
-
-        for sd in data:
-            key = (sd['name'], sd['measurement_unit'])
-            unique_data[key] += sd['amount']
-
-        for (name, measurement_unit), amount in unique_data.items():
-            text_buffer.write(
-                '• {name} ({measurement_unit}) - {amount}\n'.
-                format(
-                    name=name,
-                    measurement_unit=measurement_unit,
-                    amount=amount
-                ))
-
-        return text_buffer.getvalue()
+        chunks = self.render_lines(data)
+        if self.charset is None:
+            return b''.join(chunks)
+        return ''.join(chunks)
+
+
+class ShoppingCartCSVRenderer(ShoppingCartDataRenderer):
+    """Список покупок в формате CSV для складских систем."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('name', 'measurement_unit', 'amount')
+
+    def render_lines(self, ingredients):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.header)
+        for ingredient in ingredients:
+            writer.writerow([ingredient[field] for field in self.header])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+class ShoppingCartJSONRenderer(ShoppingCartDataRenderer):
+    """Список покупок в формате JSON для мобильного клиента."""
+
+    media_type = 'application/json'
+    format = 'json'
+
+    def render_lines(self, ingredients):
+        yield '['
+        for index, ingredient in enumerate(ingredients):
+            yield (',' if index else '') + json.dumps({
+                'name': ingredient['name'],
+                'measurement_unit': ingredient['measurement_unit'],
+                'amount': ingredient['amount']
+            }, ensure_ascii=False)
+        yield ']'
+
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    """Регистрирует шрифт с кириллицей, если он есть в системе."""
+    try:
+        pdfmetrics.registerFont(
+            TTFont('ShoppingCartFont', settings.SHOPPING_CART_PDF_FONT)
+        )
+    except (OSError, TTFError):
+        return 'Helvetica'
+    return 'ShoppingCartFont'
+
+
+class ShoppingCartPDFRenderer(ShoppingCartDataRenderer):
+    """Список покупок в формате PDF для печати."""
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+
+    def render_lines(self, ingredients):
+        buffer = io.BytesIO()
+        font = get_pdf_font()
+        width, height = A4
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        pdf.setFont(font, PDF_FONT_SIZE)
+        y = height - PDF_MARGIN
+        for line in super().render_lines(ingredients):
+            if y < PDF_MARGIN:
+                pdf.showPage()
+                pdf.setFont(font, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            pdf.drawString(PDF_MARGIN, y, line.rstrip('\n'))
+            y -= PDF_LEADING
+        pdf.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_CART_RENDERERS = (
+    ShoppingCartDataRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+    ShoppingCartPDFRenderer,
+)
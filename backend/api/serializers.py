@@ -1,12 +1,14 @@
 import djoser.serializers
+from django.conf import settings
+from django.db import models, transaction
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
-from rest_framework.validators import UniqueTogetherValidator
 
-from core.constants import MIN_VALUE, MAX_VALUE
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            Shopping_Cart, Tag)
-from users.models import User, UserSubscribe
+from api.fields import ImageVariantField, StreamingBase64ImageField
+from core.constants import BULK_MAX_IDS, MIN_VALUE, MAX_VALUE
+from recipes.cache import recipe_fragment_cache
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import User
 
 
 class ReadUserSerializer(djoser.serializers.UserSerializer):
@@ -20,11 +22,22 @@ class ReadUserSerializer(djoser.serializers.UserSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return (request.user.is_authenticated
                 and obj.following.filter(follower=request.user).exists())
 
 
+class AuthorFragmentSerializer(ReadUserSerializer):
+    """Автор рецепта без подписки текущего пользователя."""
+
+    is_subscribed = None
+
+    class Meta(ReadUserSerializer.Meta):
+        fields = ('username', 'email', 'id', 'first_name', 'last_name')
+
+
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для чтения тэгов."""
 
@@ -46,9 +59,7 @@ class IngredientsSerializer(serializers.ModelSerializer):
 class CreateRecipesIngredientsSerializer(serializers.ModelSerializer):
     """Сериализатор для добавление ингредиентов в рецепты."""
 
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-    )
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         min_value=MIN_VALUE, max_value=MAX_VALUE,
         error_messages={
@@ -84,6 +95,8 @@ class ReadRecipesIngredientsSerializer(serializers.ModelSerializer):
 class ShoppingCartAndRecipeSerializers(serializers.ModelSerializer):
     """Сериализатор для чтения краткого списка."""
 
+    image_thumb = ImageVariantField('image_thumb')
+
     class Meta:
 
         model = Recipe
@@ -91,111 +104,155 @@ class ShoppingCartAndRecipeSerializers(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumb',
             'cooking_time'
         )
 
 
-class ShoppingCartSerializers(serializers.ModelSerializer):
-    """Сериализатор для создания списка покупок."""
+class BulkIdsSerializer(serializers.Serializer):
+    """Сериализатор списка id для пакетных операций."""
 
-    class Meta:
-
-        model = Shopping_Cart
-        fields = ('author', 'recipe')
-
-    def validate(self, data):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_IDS
+    )
 
-        if not self.context.get('request').method == 'POST':
-            return data
-        if Shopping_Cart.objects.filter(
-            author=data['author'],
-            recipe=data['recipe']
-        ).exists():
-            raise serializers.ValidationError(
-                'Вы уже добавили рецепт в список покупок.'
-            )
-        return data
 
-    def to_representation(self, instance):
-        return ShoppingCartAndRecipeSerializers(instance.recipe, context={
-            'request': self.context.get('request')
-        }).data
+class RecipeFragmentSerializer(serializers.ModelSerializer):
+    """Часть рецепта, одинаковая для всех пользователей.
 
+    Ссылки на фото относительные: фрагмент не зависит от хоста запроса.
+    """
 
-class FavoriteSerializers(serializers.ModelSerializer):
-    """Сериализатор для создания подписки на рецепт."""
+    ingredients = ReadRecipesIngredientsSerializer(
+        many=True,
+        source='recipesingredients'
+    )
+    tags = TagSerializer(
+        many=True,
+        read_only=True
+    )
+    author = AuthorFragmentSerializer(read_only=True)
+    image = Base64ImageField(max_length=None)
+    image_thumb = ImageVariantField('image_thumb')
+    image_webp = ImageVariantField('image_webp')
 
     class Meta:
 
-        model = Favorite
-        fields = ('author', 'recipe')
+        model = Recipe
+        fields = (
+            'id', 'tags', 'author', 'ingredients',
+            'name', 'image', 'image_thumb', 'image_webp',
+            'text', 'cooking_time'
+        )
 
-    def validate(self, data):
 
-        if not self.context.get('request').method == 'POST':
-            return data
-        if Favorite.objects.filter(
-            author=data['author'],
-            recipe=data['recipe']
-        ).exists():
-            raise serializers.ValidationError(
-                'Вы уже добавили рецепт в избранное.'
-            )
-        return data
+class ReadRecipeListSerializer(serializers.ListSerializer):
+    """Собирает рецепты страницы из кэша фрагментов за одно обращение."""
 
-    def to_representation(self, instance):
-        return ShoppingCartAndRecipeSerializers(instance.recipe, context={
-            'request': self.context.get('request')
-        }).data
+    def to_representation(self, data):
+        if not settings.RECIPE_CACHE_TIMEOUT:
+            return super().to_representation(data)
+        recipes = data.all() if isinstance(data, models.Manager) else data
+        return self.child.to_representation_many(list(recipes))
 
 
-class ReadRecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор для чтения рецепта."""
+class ReadRecipeSerializer(RecipeFragmentSerializer):
+    """Сериализатор для чтения рецепта.
+
+    С RECIPE_CACHE_TIMEOUT общая часть берется из кэша фрагментов,
+    а флаги избранного, списка покупок и подписки на автора - из
+    аннотаций RecipeQuerySet.with_viewer_flags.
+    """
 
-    ingredients = ReadRecipesIngredientsSerializer(
-        many=True,
-        source='recipesingredients'
-    )
-    tags = TagSerializer(
-        many=True,
-        read_only=True
-    )
     author = ReadUserSerializer(read_only=True)
-    image = Base64ImageField(max_length=None)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
+    url_fields = ('image', 'image_thumb', 'image_webp')
+
     class Meta:
 
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients',
             'is_favorited', 'is_in_shopping_cart',
-            'name', 'image', 'text', 'cooking_time'
+            'name', 'image', 'image_thumb', 'image_webp',
+            'text', 'cooking_time'
         )
+        list_serializer_class = ReadRecipeListSerializer
 
     def get_is_favorited(self, recipe):
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
         request = self.context.get('request')
         return (request.user.is_authenticated
                 and recipe.favorites.filter(author=request.user.id).exists())
 
     def get_is_in_shopping_cart(self, recipe):
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
         request = self.context.get('request')
         return (request.user.is_authenticated
                 and recipe.shopping_list.filter(author=request.user).exists())
 
+    def get_is_subscribed(self, recipe):
+        if hasattr(recipe, 'is_subscribed'):
+            return recipe.is_subscribed
+        return self.fields['author'].get_is_subscribed(recipe.author)
+
+    @staticmethod
+    def build_fragments(recipe_ids):
+        recipes = Recipe.objects.for_fragments().in_bulk(recipe_ids)
+        return {
+            recipe_id: RecipeFragmentSerializer(recipe).data
+            for recipe_id, recipe in recipes.items()
+        }
+
+    def merge(self, recipe, fragment):
+        """Фрагмент с флагами пользователя в порядке полей Meta.fields."""
+        request = self.context.get('request')
+        values = {
+            **fragment,
+            'author': {**fragment['author'],
+                       'is_subscribed': self.get_is_subscribed(recipe)},
+            'is_favorited': self.get_is_favorited(recipe),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(recipe),
+        }
+        if request is not None:
+            for name in self.url_fields:
+                if values[name]:
+                    values[name] = request.build_absolute_uri(values[name])
+        return {name: values[name] for name in self.Meta.fields}
+
+    def to_representation_many(self, recipes):
+        if not recipes:
+            return []
+        fragments = recipe_fragment_cache.get_many(
+            recipes, self.build_fragments
+        )
+        return [
+            self.merge(recipe, fragments[recipe.id])
+            if recipe.id in fragments
+            else super(ReadRecipeSerializer, self).to_representation(recipe)
+            for recipe in recipes
+        ]
+
+    def to_representation(self, recipe):
+        if not settings.RECIPE_CACHE_TIMEOUT:
+            return super().to_representation(recipe)
+        return self.to_representation_many([recipe])[0]
+
 
 class CreateRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для создания рецепта."""
 
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
     ingredients = CreateRecipesIngredientsSerializer(
         many=True,
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     cooking_time = serializers.IntegerField(
         min_value=MIN_VALUE, max_value=MAX_VALUE,
         error_messages={
@@ -210,6 +267,40 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = '__all__'
 
+    @staticmethod
+    def does_not_exist(pk):
+        message = serializers.PrimaryKeyRelatedField.default_error_messages
+        return message['does_not_exist'].format(pk_value=pk)
+
+    def validate_tags(self, value):
+        tags = Tag.objects.in_bulk(set(value))
+        missing = [pk for pk in value if pk not in tags]
+        if missing:
+            raise serializers.ValidationError(
+                [self.does_not_exist(pk) for pk in missing]
+            )
+        return [tags[pk] for pk in value]
+
+    def validate_ingredients(self, value):
+        """Загружает ингредиенты одним запросом.
+
+        Ошибки остаются в формате вложенного сериализатора:
+        по словарю на каждый элемент списка.
+        """
+        ingredients = Ingredient.objects.in_bulk(
+            {item['id'] for item in value}
+        )
+        errors = [
+            {} if item['id'] in ingredients
+            else {'id': [self.does_not_exist(item['id'])]}
+            for item in value
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        for item in value:
+            item['id'] = ingredients[item['id']]
+        return value
+
     def validate(self, data):
         ingredients = data.get('ingredients', [])
         tags = data.get('tags', [])
@@ -227,40 +318,89 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             )
         return super().validate(data)
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context['request'].user
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=author, **validated_data)
-        self.create_tags_and_ingredients(recipe, tags, ingredients)
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag) for tag in tags
+        )
+        RecipeIngredient.objects.bulk_create(RecipeIngredient(
+            recipes=recipe,
+            amount=ingredient['amount'],
+            ingredients=ingredient['id'])
+            for ingredient in ingredients
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        RecipeIngredient.objects.filter(recipes=recipe).delete()
-        self.create_tags_and_ingredients(recipe, tags, ingredients)
+        recipe.tags.set(validated_data.pop('tags'))
+        self.update_ingredients(recipe, validated_data.pop('ingredients'))
         return super().update(recipe, validated_data)
 
-    def create_tags_and_ingredients(self, recipe, tags, ingredients):
-        recipe.tags.set(tags)
-        RecipeIngredient.objects.bulk_create(RecipeIngredient(
-            recipes=recipe,
-            amount=ingredient['amount'],
-            ingredients=ingredient.get('id'))
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только добавленные, удалённые и изменённые ингредиенты."""
+        current = {
+            row.ingredients_id: row
+            for row in RecipeIngredient.objects.filter(recipes=recipe)
+        }
+        amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipes=recipe, ingredients__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipes=recipe,
+                amount=ingredient['amount'],
+                ingredients=ingredient['id'],
+            )
             for ingredient in ingredients
+            if ingredient['id'].id not in current
         )
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        if settings.RECIPE_CACHE_TIMEOUT:
+            # Связи рецепта загрузит кэш фрагментов.
+            recipes = Recipe.objects.with_viewer_flags(request.user)
+        else:
+            recipes = Recipe.objects.for_read(request.user)
+        instance = recipes.get(pk=instance.pk)
         return ReadRecipeSerializer(instance, context={
-            'request': self.context.get('request')
+            'request': request
         }).data
 
 
+class SubscribtionsListSerializer(serializers.ListSerializer):
+    """Загружает превью рецептов всех авторов страницы одним запросом."""
+
+    def to_representation(self, data):
+        self.context['recipe_previews'] = Recipe.objects.previews_by_author(
+            data, self.child.get_recipes_limit()
+        )
+        return super().to_representation(data)
+
+
 class SubscribtionsSerializer(serializers.ModelSerializer):
 
     is_subscribed = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     recipes = serializers.SerializerMethodField()
 
     class Meta:
@@ -276,49 +416,29 @@ class SubscribtionsSerializer(serializers.ModelSerializer):
             'is_subscribed',
             'recipes'
         )
+        list_serializer_class = SubscribtionsListSerializer
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return (request.user.is_authenticated
                 and obj.following.filter(follower=request.user).exists())
 
-    def get_recipes_count(self, author):
-        return Recipe.objects.filter(author=author).count()
+    def get_recipes_limit(self):
+        limit = self.context.get('request').GET.get('recipes_limit')
+        if limit is not None and limit.isdigit():
+            return int(limit)
+        return None
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit is not None and limit.isdigit():
-            recipes = recipes[:int(limit)]
+        previews = self.context.get('recipe_previews')
+        if previews is not None:
+            recipes = previews[obj.id]
+        else:
+            recipes = obj.recipes.all()[:self.get_recipes_limit()]
         serializer = ShoppingCartAndRecipeSerializers(
             recipes, many=True, read_only=True, context={'request': request}
         )
         return serializer.data
-
-
-class CreateFollowSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания подписки на пользователя."""
-
-    class Meta:
-
-        model = UserSubscribe
-        fields = ('author', 'follower')
-        validators = [
-            UniqueTogetherValidator(
-                queryset=UserSubscribe.objects.all(),
-                fields=('author', 'follower'),
-                message='Невозможно подписаться, так как вы уже подписаны'
-            )
-        ]
-
-    def validate(self, data):
-        if data['author'] == data['follower']:
-            raise serializers.ValidationError('Невозможно подписаться '
-                                              'на самого себя')
-        return data
-
-    def to_representation(self, instance):
-        return SubscribtionsSerializer(instance.author, context={
-            'request': self.context.get('request')
-        }).data
@@ -0,0 +1,494 @@
+import base64
+import io
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from api.fields import StreamingBase64ImageField
+from api.filters import RecipeFilter
+from api.serializers import CreateRecipeSerializer
+from core.cache import get_author_feed_version_key, version_cache
+from core.constants import MATCH_ANY, RANKING_POPULAR
+from core.models import CacheVersion
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeScore, Shopping_Cart, Tag)
+from users.models import User, UserSubscribe
+
+RECIPES_PER_AUTHOR = 4
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@example.com', username=name,
+        first_name=name, last_name=name, password='password'
+    )
+
+
+class APITestData(TestCase):
+    """Авторы с рецептами, тегами, ингредиентами и связями читателя."""
+
+    @staticmethod
+    def clear_caches():
+        """Состояние кэшей нового процесса."""
+        cache.clear()
+        version_cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.tags = Tag.objects.bulk_create(
+            Tag(name=f'Тег {index}', color=f'#00000{index}',
+                slug=f'tag-{index}')
+            for index in range(3)
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(5)
+        )
+        cls.authors = [create_user(f'author{index}') for index in range(3)]
+        for author in cls.authors:
+            UserSubscribe.objects.add(cls.reader, [author.id])
+            for index in range(RECIPES_PER_AUTHOR):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Рецепт {index}',
+                    text='Описание', image='media/test.png',
+                    cooking_time=10
+                )
+                recipe.tags.set(cls.tags[:index % 3 + 1])
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(recipes=recipe, ingredients=ingredient,
+                                     amount=10)
+                    for ingredient in cls.ingredients[:index + 2]
+                )
+                if index % 2:
+                    Favorite.objects.add(cls.reader, [recipe.id])
+                    Shopping_Cart.objects.add(cls.reader, [recipe.id])
+
+    def setUp(self):
+        self.clear_caches()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+
+class RecipeListQueriesTest(APITestData):
+    """Список рецептов выполняет одно и то же число запросов."""
+
+    # COUNT, страница и префетчи тегов, ингредиентов и авторов.
+    queries = 5
+    # Плюс версии фрагментов.
+    cached_queries = queries + 1
+    # COUNT и страница, версии уже в памяти процесса.
+    warm_queries = 2
+
+    def assert_constant_queries(self, client, queries, warm_queries=None):
+        for limit in (1, 3, 6, 12):
+            url = f'/api/recipes/?limit={limit}'
+            with self.subTest(limit=limit):
+                self.clear_caches()
+                with self.assertNumQueries(queries):
+                    response = client.get(url)
+                self.assertEqual(len(response.data['results']), limit)
+                if warm_queries is not None:
+                    with self.assertNumQueries(warm_queries):
+                        self.assertEqual(client.get(url).data, response.data)
+
+    def test_anonymous(self):
+        self.assert_constant_queries(
+            self.anonymous, self.cached_queries, self.warm_queries
+        )
+
+    def test_authenticated(self):
+        self.assert_constant_queries(
+            self.client, self.cached_queries, self.warm_queries
+        )
+
+    @override_settings(RECIPE_CACHE_TIMEOUT=0)
+    def test_anonymous_without_fragment_cache(self):
+        self.assert_constant_queries(self.anonymous, self.queries)
+
+    @override_settings(RECIPE_CACHE_TIMEOUT=0)
+    def test_authenticated_without_fragment_cache(self):
+        self.assert_constant_queries(self.client, self.queries)
+
+    def test_flags(self):
+        response = self.client.get('/api/recipes/?limit=12')
+        for recipe in response.data['results']:
+            favorited = Favorite.objects.filter(
+                author=self.reader, recipe=recipe['id']
+            ).exists()
+            self.assertEqual(recipe['is_favorited'], favorited)
+            self.assertEqual(recipe['is_in_shopping_cart'], favorited)
+            self.assertTrue(recipe['author']['is_subscribed'])
+
+
+class SubscriptionsQueriesTest(APITestData):
+    """Подписки загружают превью рецептов всех авторов одним запросом."""
+
+    # COUNT, страница авторов и превью рецептов.
+    queries = 3
+
+    def test_queries(self):
+        for limit in (1, 2, 3):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(self.queries):
+                    response = self.client.get(
+                        f'/api/users/subscriptions/?limit={limit}'
+                    )
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipes_limit(self):
+        for recipes_limit in (None, 1, 2, RECIPES_PER_AUTHOR + 1):
+            url = '/api/users/subscriptions/'
+            if recipes_limit is not None:
+                url += f'?recipes_limit={recipes_limit}'
+            with self.subTest(recipes_limit=recipes_limit):
+                with self.assertNumQueries(self.queries):
+                    response = self.client.get(url)
+                expected = min(recipes_limit or RECIPES_PER_AUTHOR,
+                               RECIPES_PER_AUTHOR)
+                for author in response.data['results']:
+                    self.assertEqual(len(author['recipes']), expected)
+                    self.assertEqual(author['recipes_count'],
+                                     RECIPES_PER_AUTHOR)
+                    self.assertTrue(author['is_subscribed'])
+
+
+class RecipeIngredientsTest(APITestData):
+    """Проверка и обновление ингредиентов рецепта."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = Recipe.objects.filter(
+            author=self.authors[0]
+        ).order_by('id').first()
+        self.serializer = CreateRecipeSerializer(
+            context={'request': None}
+        )
+
+    def current(self):
+        return dict(
+            RecipeIngredient.objects.filter(recipes=self.recipe)
+            .values_list('ingredients', 'amount')
+        )
+
+    def test_unknown_ingredient_error(self):
+        missing = Ingredient.objects.order_by('id').last().id + 1
+        serializer = CreateRecipeSerializer(data={
+            'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 1},
+                {'id': missing, 'amount': 1},
+            ],
+            'tags': [tag.id for tag in self.tags],
+        })
+        self.assertFalse(serializer.is_valid())
+        errors = serializer.errors['ingredients']
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['id'])
+        self.assertIn(str(missing), errors[1]['id'][0])
+
+    def test_ingredients_validated_in_one_query(self):
+        value = [
+            {'id': ingredient.id, 'amount': 1}
+            for ingredient in reversed(self.ingredients)
+        ]
+        with self.assertNumQueries(1):
+            validated = self.serializer.validate_ingredients(value)
+        self.assertEqual(
+            [item['id'] for item in validated],
+            list(reversed(self.ingredients))
+        )
+
+    def test_update_changes_only_difference(self):
+        first, second, third = self.ingredients[:3]
+        self.assertEqual(self.current(), {first.id: 10, second.id: 10})
+        ingredients = [
+            {'id': second, 'amount': 20},
+            {'id': third, 'amount': 30},
+        ]
+        # Текущие строки, удаление (SELECT и DELETE), сброс версии
+        # рецепта сигналом удаления, UPDATE и INSERT.
+        with self.assertNumQueries(6):
+            self.serializer.update_ingredients(self.recipe, ingredients)
+        self.assertEqual(self.current(), {second.id: 20, third.id: 30})
+
+    def test_update_unchanged_ingredients(self):
+        ingredients = [
+            {'id': ingredient, 'amount': amount}
+            for ingredient, amount in zip(self.ingredients, (10, 10))
+        ]
+        with self.assertNumQueries(1):
+            self.serializer.update_ingredients(self.recipe, ingredients)
+        self.assertEqual(
+            self.current(),
+            {ingredient.id: 10 for ingredient in self.ingredients[:2]}
+        )
+
+
+class ReferenceCacheTest(APITestData):
+    """Ответы справочников кэшируются по версии таблицы."""
+
+    def test_not_modified(self):
+        response = self.anonymous.get('/api/tags/')
+        with self.assertNumQueries(0):
+            response = self.anonymous.get(
+                '/api/tags/', HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        last_modified = self.anonymous.get('/api/tags/')['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.anonymous.get(
+                '/api/tags/', HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+        self.assertEqual(response.status_code, 304)
+        response = self.anonymous.get(
+            '/api/tags/', HTTP_IF_MODIFIED_SINCE=last_modified,
+            HTTP_IF_NONE_MATCH='"other"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_bump_changes_etag(self):
+        etag = self.anonymous.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        response = self.anonymous.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), len(self.tags) + 1)
+
+    def test_bump_from_other_process(self):
+        etag = self.anonymous.get('/api/tags/')['ETag']
+        # Фиксация в другом процессе: в кэшах этого процесса старая версия.
+        Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        self.assertEqual(self.anonymous.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=etag
+        ).status_code, 304)
+        # Локальная версия истекла, общий кэш в тестах - свой у процесса.
+        self.clear_caches()
+        response = self.anonymous.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), len(self.tags) + 1)
+
+
+class CreateRecipeRepresentationTest(APITestData):
+    """Ответ на создание и изменение рецепта загружает его один раз."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = Recipe.objects.filter(author=self.authors[1]).first()
+        self.request = RequestFactory().get('/api/recipes/')
+        self.request.user = self.reader
+
+    def represent(self):
+        return CreateRecipeSerializer(
+            self.recipe, context={'request': self.request}
+        ).data
+
+    def test_with_fragment_cache(self):
+        # Рецепт с флагами, версии фрагмента, рецепт со связями
+        # и префетчи тегов и ингредиентов.
+        with self.assertNumQueries(5):
+            data = self.represent()
+        self.assertTrue(data['author']['is_subscribed'])
+
+    @override_settings(RECIPE_CACHE_TIMEOUT=0)
+    def test_without_fragment_cache(self):
+        # Рецепт с флагами и префетчи автора, тегов и ингредиентов.
+        with self.assertNumQueries(4):
+            data = self.represent()
+        self.assertTrue(data['author']['is_subscribed'])
+
+
+class IngredientSearchTest(APITestData):
+    """Автодополнение ингредиентов отвечает из памяти процесса."""
+
+    def test_keystrokes_without_queries(self):
+        self.anonymous.get('/api/ingredients/?name=и')
+        for name in ('ин', 'инг', 'ингр', 'редиент 3'):
+            with self.subTest(name=name):
+                with self.assertNumQueries(0):
+                    response = self.anonymous.get(
+                        f'/api/ingredients/?name={name}'
+                    )
+                self.assertEqual(response.status_code, 200)
+
+    def test_reloaded_after_change(self):
+        self.anonymous.get('/api/ingredients/?name=и')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Имбирь', measurement_unit='г')
+        response = self.anonymous.get('/api/ingredients/?name=имб')
+        self.assertEqual([item['name'] for item in response.data],
+                         ['Имбирь'])
+
+
+class RecipeOrderingTest(APITestData):
+    """Сортировки фильтров складываются, а не заменяют друг друга."""
+
+    def setUp(self):
+        super().setUp()
+        RecipeScore.objects.refresh(
+            Recipe.objects.values_list('id', flat=True)
+        )
+        ingredients = ','.join(
+            str(ingredient.id) for ingredient in self.ingredients
+        )
+        self.url = f'/api/recipes/?ingredients={ingredients}&match=any'
+
+    def get_ids(self, url):
+        return [
+            recipe['id']
+            for recipe in self.anonymous.get(url).data['results']
+        ]
+
+    def test_coverage_then_ranking(self):
+        expected = list(
+            Recipe.objects.with_ingredients(
+                [ingredient.id for ingredient in self.ingredients],
+                MATCH_ANY
+            ).order_by('-coverage', '-score__popular', '-id')
+            .values_list('id', flat=True)
+        )
+        url = self.url + f'&ordering={RANKING_POPULAR}&limit=100'
+        self.assertEqual(self.get_ids(url), expected)
+        self.assertEqual(self.get_ids(url + '&cursor='), expected)
+
+    def test_ranking_order_matches_index(self):
+        queryset = RecipeFilter(
+            {'ordering': RANKING_POPULAR}, Recipe.objects.all()
+        ).qs
+        self.assertEqual(queryset.query.order_by,
+                         (f'-score__{RANKING_POPULAR}', '-id'))
+
+
+class KeysetPaginationTest(APITestData):
+    """Курсорная пагинация сохраняет порядок фильтров релевантности."""
+
+    def walk(self, url):
+        ids = []
+        url += '&cursor=' if '?' in url else '?cursor='
+        while url:
+            response = self.anonymous.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_coverage_ordering(self):
+        ingredients = ','.join(
+            str(ingredient.id) for ingredient in self.ingredients
+        )
+        url = f'/api/recipes/?ingredients={ingredients}&match=any'
+        expected = [
+            recipe['id']
+            for recipe in self.anonymous.get(url + '&limit=100').data[
+                'results'
+            ]
+        ]
+        self.assertEqual(len(expected), len(self.authors) * RECIPES_PER_AUTHOR)
+        self.assertEqual(self.walk(url + '&limit=5'), expected)
+        best = Recipe.objects.filter(
+            name=f'Рецепт {RECIPES_PER_AUTHOR - 1}'
+        ).order_by('-pub_date', '-id').values_list('id', flat=True)
+        self.assertEqual(expected[:len(self.authors)], list(best))
+
+    def test_previous_page(self):
+        url = '/api/recipes/?limit=5&cursor='
+        first = self.anonymous.get(url).data
+        second = self.anonymous.get(first['next']).data
+        previous = self.anonymous.get(second['previous']).data
+        self.assertEqual(previous['results'], first['results'])
+
+
+class FeedCacheTest(APITestData):
+    """Публикация сбрасывает ленты подписчиков одной версией автора."""
+
+    def get_feed_ids(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def publish(self, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                author=author, name='Новый рецепт', text='Описание',
+                image='media/test.png', cooking_time=10
+            )
+
+    def feed_versions(self):
+        return dict(CacheVersion.objects.filter(
+            key__startswith='version:feed:'
+        ).values_list('key', 'version'))
+
+    def test_cached_page(self):
+        expected = self.get_feed_ids()
+        # Только сами рецепты страницы: id, версии и подписки - из кэша.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_feed_ids(), expected)
+
+    def test_publish_bumps_author_version(self):
+        author = self.authors[0]
+        for index in range(3):
+            UserSubscribe.objects.add(create_user(f'follower{index}'),
+                                      [author.id])
+        self.get_feed_ids()
+        before = self.feed_versions()
+        recipe = self.publish(author)
+        after = self.feed_versions()
+        self.assertEqual(
+            {key for key in after if after[key] != before.get(key)},
+            {get_author_feed_version_key(author.id)}
+        )
+        self.assertEqual(self.get_feed_ids()[0], recipe.id)
+
+    def test_subscription_changes_feed(self):
+        author = create_user('author')
+        self.get_feed_ids()
+        recipe = self.publish(author)
+        self.assertNotIn(recipe.id, self.get_feed_ids())
+        with self.captureOnCommitCallbacks(execute=True):
+            UserSubscribe.objects.add(self.reader, [author.id])
+        self.assertEqual(self.get_feed_ids()[0], recipe.id)
+
+
+class StreamingBase64ImageFieldTest(SimpleTestCase):
+    """Фото в base64 декодируется блоками, в том числе с переносами строк."""
+
+    def setUp(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), 'red').save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+        # Блок не кратен четырем символам и рвет строки MIME.
+        chunk = mock.patch('api.fields.IMAGE_DECODE_CHUNK', 10)
+        chunk.start()
+        self.addCleanup(chunk.stop)
+
+    def decode(self, encoded):
+        file = StreamingBase64ImageField().to_internal_value(
+            'data:image/png;base64,' + encoded
+        )
+        self.assertTrue(file.name.endswith('.png'))
+        return file.read()
+
+    def test_plain(self):
+        encoded = base64.b64encode(self.png).decode()
+        self.assertEqual(self.decode(encoded), self.png)
+
+    def test_mime_wrapped(self):
+        for newline in ('\n', '\r\n'):
+            with self.subTest(newline=repr(newline)):
+                encoded = base64.encodebytes(self.png).decode().replace(
+                    '\n', newline
+                )
+                self.assertEqual(self.decode(encoded), self.png)
+
+    def test_truncated(self):
+        encoded = base64.b64encode(self.png).decode()[:-1]
+        with self.assertRaises(ValidationError):
+            self.decode(encoded)
@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import (IngredientsViewSet, RecipesViewSet, TagViewSet,
-                       UserViewSet)
+from api.views import (IngredientsViewSet, MetricsView, RecipesViewSet,
+                       RequestStatsView, TagViewSet, UserViewSet)
 
 routers_v1 = DefaultRouter()
 
@@ -12,5 +12,7 @@ routers_v1.register('ingredients', IngredientsViewSet, basename='ingredients')
 routers_v1.register('users', UserViewSet, basename='subscribe')
 
 urlpatterns = [
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('stats/', RequestStatsView.as_view(), name='stats'),
     path('', include(routers_v1.urls))
 ]
@@ -1,30 +1,45 @@
+import os
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import (SAFE_METHODS, AllowAny,
-                                        IsAuthenticated,
+                                        IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
 from api.filters import RecipeFilter, SearchIngredientsFilter
-from api.paginations import PageNumberAndLimitPagination
+from api.mixins import (AsyncReadMixin, BulkRelationMixin,
+                        VersionedCacheMixin)
+from api.paginations import FeedPagination, PageNumberAndLimitPagination
 from api.permissions import IsAuthorOrReadOnlyPermission
-from api.renders import ShoppingCartDataRenderer
-from api.serializers import (CreateFollowSerializer, CreateRecipeSerializer,
-                             FavoriteSerializers, IngredientsSerializer,
-                             ReadRecipeSerializer,
-                             ReadRecipesIngredientsSerializer,
-                             ReadUserSerializer,
-                             ShoppingCartSerializers, SubscribtionsSerializer,
-                             TagSerializer, )
+from api.renders import SHOPPING_CART_RENDERERS, PrometheusRenderer
+from api.serializers import (CreateRecipeSerializer, IngredientsSerializer,
+                             ReadRecipeSerializer, ReadUserSerializer,
+                             ShoppingCartAndRecipeSerializers,
+                             SubscribtionsSerializer, TagSerializer)
+from core.constants import INGREDIENT_SEARCH_LIMIT
+from core.metrics import request_stats
+from core.prometheus import metrics_store, render_metrics
+from recipes.cache import ingredient_search_cache
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                             Shopping_Cart, Tag)
+from users.cache import token_cache
 from users.models import User, UserSubscribe
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+NON_FIELD_ERRORS_KEY = api_settings.NON_FIELD_ERRORS_KEY
+
+
+class RecipesViewSet(AsyncReadMixin, BulkRelationMixin,
+                     viewsets.ModelViewSet):
     """ViewSet для работы с рецептами."""
 
     queryset = Recipe.objects.all()
@@ -35,32 +50,33 @@ class RecipesViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     pagination_class = PageNumberAndLimitPagination
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        if self.request.method not in SAFE_METHODS:
+            return super().get_queryset()
+        if settings.RECIPE_CACHE_TIMEOUT:
+            return Recipe.objects.with_viewer_flags(self.request.user)
+        return Recipe.objects.for_read(self.request.user)
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return ReadRecipeSerializer
         return CreateRecipeSerializer
 
-    def create_favorite_or_shopping_cart(self, request,
-                                         pk, serializer_class):
-        context = {'request': request}
+    def create_favorite_or_shopping_cart(self, request, pk, model, message):
         recipe = get_object_or_404(Recipe, id=pk)
-        data = {
-            'author': request.user.id,
-            'recipe': recipe.id
-        }
-        serializer = serializer_class(data=data, context=context)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        if not model.objects.add(request.user, [recipe.id]):
+            raise ValidationError({NON_FIELD_ERRORS_KEY: [message]})
+        serializer = ShoppingCartAndRecipeSerializers(
+            recipe, context={'request': request}
+        )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy_favorite_or_shopping_cart(self, request, pk, model):
-        model = model.objects.filter(
-            author=request.user.id,
-            recipe=get_object_or_404(Recipe, id=pk))
-        if model.exists():
-            model.delete()
+        if model.objects.remove(request.user, [pk]):
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, id=pk)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
     @action(
@@ -69,30 +85,65 @@ class RecipesViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def shopping_cart(self, request, pk):
-        return self.create_favorite_or_shopping_cart(request, pk,
-                                                     ShoppingCartSerializers)
+        return self.create_favorite_or_shopping_cart(
+            request, pk, Shopping_Cart,
+            'Вы уже добавили рецепт в список покупок.'
+        )
 
     @shopping_cart.mapping.delete
     def destroy_shopping_cart(self, request, pk):
         return self.destroy_favorite_or_shopping_cart(request, pk,
                                                       Shopping_Cart)
 
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='shopping_cart/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def shopping_cart_bulk(self, request):
+        return self.bulk_relation(request, Recipe.objects.all(),
+                                  Shopping_Cart.objects)
+
+    @action(
+        detail=False,
+        methods=['DELETE'],
+        url_path='shopping_cart',
+        permission_classes=(IsAuthenticated,)
+    )
+    def clear_shopping_cart(self, request):
+        Shopping_Cart.objects.remove(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(
         detail=False,
         methods=['GET'],
-        renderer_classes=(ShoppingCartDataRenderer,)
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination
+    )
+    def feed(self, request):
+        queryset = self.get_queryset().feed(request.user)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        renderer_classes=SHOPPING_CART_RENDERERS
     )
     def download_shopping_cart(self, request):
-        queryset = RecipeIngredient.objects.filter(
-            recipes__shopping_list__author=request.user.id
+        ingredients = RecipeIngredient.objects.shopping_list(request.user)
+        renderer = request.accepted_renderer
+        file_name = f'Shopping List.{renderer.format}'
+        response = StreamingHttpResponse(
+            renderer.render_lines(ingredients.iterator()),
+            content_type=renderer.content_type
         )
-        file_name = f'Shopping List.{request.accepted_renderer.format}'
-        serializer = ReadRecipesIngredientsSerializer(queryset, many=True)
-        return Response(serializer.data, headers={
-            "Content-Disposition":
+        response['Content-Disposition'] = (
             f'attachment; filename="{file_name}"'
-        }
         )
+        return response
 
     @action(
         detail=True,
@@ -100,39 +151,67 @@ class RecipesViewSet(viewsets.ModelViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def favorite(self, request, pk):
-        return self.create_favorite_or_shopping_cart(request, pk,
-                                                     FavoriteSerializers)
+        return self.create_favorite_or_shopping_cart(
+            request, pk, Favorite, 'Вы уже добавили рецепт в избранное.'
+        )
 
     @favorite.mapping.delete
     def destroy_favorite(self, request, pk):
         return self.destroy_favorite_or_shopping_cart(request, pk, Favorite)
 
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='favorite/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        return self.bulk_relation(request, Recipe.objects.all(),
+                                  Favorite.objects)
+
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(AsyncReadMixin, VersionedCacheMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """ViewSet для работы с тэгами."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    authentication_classes = ()
     permission_classes = (AllowAny,)
     pagination_class = None
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(AsyncReadMixin, VersionedCacheMixin,
+                         viewsets.ReadOnlyModelViewSet):
     """ViewSet для работы с ингредиентами."""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientsSerializer
+    authentication_classes = ()
     permission_classes = (AllowAny,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = SearchIngredientsFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name and settings.INGREDIENT_SEARCH_CACHE:
+            return Response(
+                ingredient_search_cache.search(name, INGREDIENT_SEARCH_LIMIT)
+            )
+        return super().list(request, *args, **kwargs)
 
-class UserViewSet(UserViewSet):
+
+class UserViewSet(BulkRelationMixin, UserViewSet):
     """ViewSet для работы с пользователями."""
     queryset = User.objects.all()
     serializer_class = ReadUserSerializer
     pagination_class = PageNumberAndLimitPagination
+    cursor_ordering = ('username', 'id')
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        return super().get_queryset().with_is_subscribed(self.request.user)
 
     @action(
         detail=False,
@@ -142,7 +221,10 @@ class UserViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def me(self, request):
-        user = get_object_or_404(User, id=self.request.user.id)
+        user = get_object_or_404(
+            User.objects.with_is_subscribed(request.user),
+            id=request.user.id
+        )
         serializer = ReadUserSerializer(
             user,
             context={'request': request}
@@ -157,29 +239,39 @@ class UserViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def subscribe(self, request, id):
-
-        context = {'request': request}
-        usersubscribe = get_object_or_404(User, id=id)
-        data = {
-            'author': usersubscribe.id,
-            'follower': request.user.id
-        }
-        serializer = CreateFollowSerializer(data=data, context=context)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        author = get_object_or_404(User, id=id)
+        if author == request.user:
+            raise ValidationError({NON_FIELD_ERRORS_KEY: [
+                'Невозможно подписаться на самого себя'
+            ]})
+        if not UserSubscribe.objects.add(request.user, [author.id]):
+            raise ValidationError({NON_FIELD_ERRORS_KEY: [
+                'Невозможно подписаться, так как вы уже подписаны'
+            ]})
+        author.is_subscribed = True
+        serializer = SubscribtionsSerializer(
+            author, context={'request': request}
+        )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
     def destroy_subscribe(self, request, id):
-        subscribe = UserSubscribe.objects.filter(
-            author_id=get_object_or_404(User, id=id),
-            follower=request.user.id
-        )
-        if subscribe.exists():
-            subscribe.delete()
+        if UserSubscribe.objects.remove(request.user, [id]):
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(User, id=id)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='subscribe/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def subscribe_bulk(self, request):
+        return self.bulk_relation(request, User.objects.all(),
+                                  UserSubscribe.objects,
+                                  forbidden=(request.user.id,))
+
     @action(
         detail=False,
         methods=['GET'],
@@ -189,10 +281,49 @@ class UserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         queryset = User.objects.filter(
-            following__follower=self.request.user.id
-        )
+            following__follower=request.user.id
+        ).with_is_subscribed(request.user)
         pages = self.paginate_queryset(queryset)
         serializer = SubscribtionsSerializer(
             pages, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
+
+
+class RequestStatsView(APIView):
+    """Процентили замеров RequestMetricsMiddleware по view.
+
+    Замеры хранятся в памяти процесса, поэтому при нескольких
+    воркерах каждый ответ описывает только один из них.
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            'enabled': settings.REQUEST_METRICS,
+            'pid': os.getpid(),
+            'views': request_stats.summary(),
+            'token_cache': token_cache.stats(),
+        })
+
+    def delete(self, request):
+        request_stats.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MetricsView(APIView):
+    """Метрики всех воркеров для Prometheus.
+
+    Доступ ограничивается на уровне nginx.
+    """
+
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        if not settings.PROMETHEUS_METRICS:
+            raise NotFound
+        return Response(render_metrics(metrics_store),
+                        content_type=PrometheusRenderer.content_type)
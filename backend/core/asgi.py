@@ -0,0 +1,52 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler as BaseASGIHandler
+
+
+class ASGIHandler(BaseASGIHandler):
+    """ASGIHandler, перебирающий потоковые ответы вне цикла событий.
+
+    Django 3.2 перебирает StreamingHttpResponse прямо в цикле событий:
+    генератор с запросами к базе (список покупок) падает
+    с SynchronousOnlyOperation, а рендер PDF останавливает все
+    остальные запросы процесса. Здесь каждая часть ответа читается
+    в том же потоке синхронного кода, где выполнялся view.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.get_response_headers(response),
+        })
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await next_part(parts, None)
+            if part is None:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    @staticmethod
+    def get_response_headers(response):
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append(
+                (b'Set-Cookie', cookie.output(header='').encode('ascii')
+                 .strip())
+            )
+        return headers
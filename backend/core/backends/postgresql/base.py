@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+
+import psycopg2
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from core.metrics import current_metrics
+from core.prometheus import record_db_event
+
+
+class ConnectionPool:
+    """Соединения psycopg2, общие для всех потоков процесса.
+
+    Открывает не больше size соединений. Если все заняты, ждет
+    освобождения до timeout секунд, затем поднимает OperationalError.
+    Первым выдается последнее возвращенное соединение.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self._idle = []
+        self._opened = 0
+
+    def _check_fork(self):
+        # Соединения родителя нельзя закрывать и использовать в потомке.
+        if self.pid != os.getpid():
+            self._reset()
+
+    def get(self, connect, check):
+        """Соединение из пула или новое, время ожидания и источник."""
+        started = time.perf_counter()
+        with self._condition:
+            self._check_fork()
+            while not self._idle and self._opened >= self.size:
+                remaining = started + self.timeout - time.perf_counter()
+                if remaining <= 0:
+                    record_db_event('timeout')
+                    raise psycopg2.OperationalError(
+                        f'Нет свободного соединения в пуле из {self.size} '
+                        f'за {self.timeout} с.'
+                    )
+                self._condition.wait(remaining)
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                self._opened += 1
+        wait = time.perf_counter() - started
+        if connection is not None and check and not is_usable(connection):
+            record_db_event('unhealthy')
+            connection.close()
+            connection = None
+        if connection is not None:
+            return connection, wait, 'pooled'
+        try:
+            return connect(), wait, 'opened'
+        except Exception:
+            self.discard()
+            raise
+
+    def put(self, connection):
+        """Возвращает соединение в пул или закрывает испорченное."""
+        if not connection.closed and (
+            connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+        ):
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+        with self._condition:
+            if self.pid != os.getpid():
+                return
+            if connection.closed or (
+                connection.get_transaction_status()
+                != TRANSACTION_STATUS_IDLE
+            ):
+                self._opened -= 1
+                connection.close()
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+    def discard(self):
+        with self._condition:
+            if self.pid == os.getpid():
+                self._opened -= 1
+                self._condition.notify()
+
+
+def is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except psycopg2.Error:
+        return False
+    return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(
+                settings_dict['POOL_SIZE'], settings_dict['POOL_TIMEOUT']
+            )
+        return _pools[alias]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Бэкенд PostgreSQL с проверкой и пулом соединений.
+
+    CONN_HEALTH_CHECKS: постоянное соединение (CONN_MAX_AGE) перед
+    первым запросом каждого HTTP-запроса проверяется SELECT 1
+    и переоткрывается, если база его разорвала.
+    POOL_SIZE больше 0 включает пул в памяти процесса: соединение
+    берется из пула при первом запросе к базе и возвращается в конце
+    HTTP-запроса, POOL_TIMEOUT - предельное ожидание свободного.
+    """
+
+    health_check_done = False
+
+    @property
+    def pool(self):
+        if not self.settings_dict.get('POOL_SIZE'):
+            return None
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        started = time.perf_counter()
+        if self.pool is None:
+            connection = super().get_new_connection(conn_params)
+            wait, source = None, 'opened'
+        else:
+            connection, wait, source = self.pool.get(
+                lambda: super(DatabaseWrapper, self).get_new_connection(
+                    conn_params
+                ),
+                check=self.settings_dict.get('CONN_HEALTH_CHECKS')
+            )
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.connect_time += time.perf_counter() - started
+        record_db_event(source, wait)
+        return connection
+
+    def connect(self):
+        # Свежее соединение не проверяется, в том числе из set_autocommit
+        # внутри connect.
+        self.health_check_done = True
+        super().connect()
+
+    @async_unsafe
+    def ensure_connection(self):
+        if (self.connection is not None and not self.health_check_done
+                and not self.in_atomic_block):
+            self.health_check_done = True
+            if (self.settings_dict.get('CONN_HEALTH_CHECKS')
+                    and not self.is_usable()):
+                record_db_event('unhealthy')
+                self.close()
+            else:
+                record_db_event('reused')
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        if self.connection is not None and self.pool is not None:
+            self.close()
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        self.pool.put(self.connection)
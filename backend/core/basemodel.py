@@ -1,14 +1,55 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
+from core.counters import update_counter
+from core.sql import delete_returning, insert_ignore
 from users.models import User
 
 
+class AuthorRecipeQuerySet(models.QuerySet):
+    """Набор запросов для связей пользователей с рецептами."""
+
+    def add(self, author, recipe_ids):
+        """Добавляет рецепты одним INSERT ... ON CONFLICT DO NOTHING.
+
+        Возвращает id рецептов, которые действительно были добавлены.
+        Время добавления запоминается в last_event рецептов: по нему
+        пересчитываются рейтинги, даже если счетчик не изменился.
+        """
+        created = timezone.now()
+        with transaction.atomic(using=self.db):
+            added = insert_ignore(self.model, [
+                {'author': author.id, 'recipe': recipe_id, 'created': created}
+                for recipe_id in recipe_ids
+            ], 'recipe', self.db)
+            update_counter(self.model.recipe.field.related_model, added,
+                           self.model.counter_field, 1, last_event=created)
+        return added
+
+    def remove(self, author, recipe_ids=None):
+        """Удаляет рецепты одним DELETE, возвращает id удаленных.
+
+        Без recipe_ids удаляет все рецепты пользователя.
+        """
+        conditions = {'author': [author.id]}
+        if recipe_ids is not None:
+            conditions['recipe'] = recipe_ids
+        with transaction.atomic(using=self.db):
+            removed = delete_returning(self.model, 'recipe', self.db,
+                                       **conditions)
+            update_counter(self.model.recipe.field.related_model, removed,
+                           self.model.counter_field, -1)
+        return removed
+
+
 class AuthorRecipeModel(models.Model):
     """Абстрактная модель.
 
     Attributes:
         author (ForeignKey):Поле, содержащие pk автора.
         recipe (ForeignKey):Поле, содержащие pk рецепта.
+        created (DateTimeField):Время добавления, нужно для рейтингов.
+        counter_field (str):Счетчик рецепта, отражающий число связей.
     """
 
     author = models.ForeignKey(
@@ -21,11 +62,21 @@ class AuthorRecipeModel(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
+
+    objects = AuthorRecipeQuerySet.as_manager()
 
     class Meta:
 
         abstract = True
         ordering = ['recipe']
+        constraints = (
+            models.UniqueConstraint(fields=('author', 'recipe'),
+                                    name='unique_%(class)s_author_recipe'),
+        )
 
     def __str__(self):
         return f'{self.author} : {self.recipe}'
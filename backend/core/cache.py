@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.constants import CACHE_VERSION_BATCH_SIZE, CACHE_VERSION_LOCAL_SIZE
+from core.models import CacheVersion
+from core.sql import upsert
+
+
+def get_version_key(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def get_feed_version_key(user_id):
+    return f'version:feed:{user_id}'
+
+
+def get_author_feed_version_key(author_id):
+    return f'version:feed:author:{author_id}'
+
+
+class VersionCache:
+    """Версии закэшированных данных.
+
+    Источник истины - таблица CacheVersion: новая версия пишется
+    в транзакции вместе с изменением и видна всем процессам после
+    фиксации. Читаются версии сначала из памяти процесса (не дольше
+    CACHE_VERSION_LOCAL_TIMEOUT секунд), затем из общего кэша Django,
+    если он общий (SHARED_CACHE), и только при промахе - из базы.
+    Поэтому условный запрос обычно обходится без SQL, а сброс
+    из другого процесса доходит не позже CACHE_VERSION_LOCAL_TIMEOUT.
+
+    Версия - метка времени сброса в наносекундах, для ключей,
+    которые еще не сбрасывались, - 0.
+    """
+
+    def __init__(self, size=CACHE_VERSION_LOCAL_SIZE):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.size = size
+
+    def _get_local(self, keys):
+        now = time.monotonic()
+        versions = {}
+        with self._lock:
+            for key in keys:
+                expires, version = self._items.get(key, (0, None))
+                if expires > now:
+                    self._items.move_to_end(key)
+                    versions[key] = version
+        return versions
+
+    def _remember(self, versions):
+        timeout = settings.CACHE_VERSION_LOCAL_TIMEOUT
+        if timeout <= 0:
+            return
+        expires = time.monotonic() + timeout
+        with self._lock:
+            for key, version in versions.items():
+                # Версии растут: запоздавшее чтение не откатывает сброс.
+                _, known = self._items.get(key, (0, version))
+                self._items[key] = (expires, max(version, known))
+                self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def get_many(self, keys):
+        """Версии под ключами keys, из базы - не больше одного запроса."""
+        keys = list(dict.fromkeys(keys))
+        versions = self._get_local(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing and settings.SHARED_CACHE:
+            shared = cache.get_many(missing)
+            self._remember(shared)
+            versions.update(shared)
+            missing = [key for key in missing if key not in shared]
+        if missing:
+            stored = dict(
+                CacheVersion.objects.filter(key__in=missing)
+                .values_list('key', 'version')
+            )
+            loaded = {key: stored.get(key, 0) for key in missing}
+            if settings.SHARED_CACHE:
+                # add, а не set: версию, опубликованную после нашего
+                # чтения базы, старое значение не перезапишет.
+                for key, version in loaded.items():
+                    cache.add(key, version, settings.CACHE_VERSION_TIMEOUT)
+            self._remember(loaded)
+            versions.update(loaded)
+        return versions
+
+    def bump_many(self, keys):
+        """Помечает данные под ключами keys устаревшими.
+
+        Новые версии записываются в текущей транзакции, поэтому
+        старые данные не попадут в кэш под новой версией, а в кэши
+        попадают после фиксации. Ключи сортируются, чтобы параллельные
+        транзакции блокировали строки в одном порядке.
+        """
+        keys = sorted(set(keys))
+        if not keys:
+            return
+        version = time.time_ns()
+        for start in range(0, len(keys), CACHE_VERSION_BATCH_SIZE):
+            upsert(CacheVersion, [
+                {'key': key, 'version': version}
+                for key in keys[start:start + CACHE_VERSION_BATCH_SIZE]
+            ], ('key',), ('version',))
+        transaction.on_commit(
+            lambda: self._publish(dict.fromkeys(keys, version))
+        )
+
+    def _publish(self, versions):
+        if settings.SHARED_CACHE:
+            cache.set_many(versions, settings.CACHE_VERSION_TIMEOUT)
+        self._remember(versions)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+version_cache = VersionCache()
+
+
+def get_versions(keys):
+    """Версии под ключами keys."""
+    return version_cache.get_many(keys)
+
+
+def bump_versions(keys):
+    """Помечает данные под ключами keys устаревшими."""
+    version_cache.bump_many(keys)
+
+
+def get_version(model):
+    """Возвращает текущую версию содержимого таблицы model."""
+    key = get_version_key(model)
+    return get_versions([key])[key]
+
+
+def bump_version(model):
+    """Помечает все закэшированные данные таблицы model устаревшими."""
+    bump_versions([get_version_key(model)])
+
+
+def get_feed_version(user_id):
+    """Возвращает версию ленты пользователя user_id."""
+    key = get_feed_version_key(user_id)
+    return get_versions([key])[key]
+
+
+def invalidate_feeds(user_ids):
+    """Помечает закэшированные ленты пользователей user_ids устаревшими."""
+    bump_versions(get_feed_version_key(user_id) for user_id in user_ids)
+
+
+def get_author_feed_versions(author_ids):
+    """Версии публикаций авторов author_ids в лентах подписчиков."""
+    return get_versions(map(get_author_feed_version_key, author_ids))
+
+
+def invalidate_author_feeds(author_ids):
+    """Помечает устаревшими ленты всех подписчиков авторов author_ids.
+
+    Сбрасывается одна версия на автора, а не по версии на подписчика:
+    ленты сверяют версии авторов из подписок при чтении.
+    """
+    bump_versions(map(get_author_feed_version_key, author_ids))
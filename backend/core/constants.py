@@ -7,3 +7,45 @@ LENGTH_FOR_NAME = 200
 LENGTH_FOR_MEASUREMENT_UNIT = 20
 PAGE_SIZE = 6
 PAGE_PARAM = 'limit'
+PDF_FONT_SIZE = 12
+PDF_LEADING = 18
+PDF_MARGIN = 50
+BENCHMARK_RENDER_LINES = 5000
+BENCHMARK_RENDER_BUDGET = 2.0
+INGREDIENT_SEARCH_LIMIT = 30
+SEED_BATCH_SIZE = 1000
+BULK_MAX_IDS = 100
+IMAGE_THUMB_SIZE = (480, 480)
+IMAGE_WEBP_QUALITY = 80
+IMAGE_DECODE_CHUNK = 4 * 64 * 1024
+SEARCH_CONFIG = 'russian'
+BENCHMARK_SEARCH_BUDGET = 0.2
+MATCH_ALL = 'all'
+MATCH_ANY = 'any'
+MATCH_MOST = 'most'
+REQUEST_METRICS_SAMPLES = 1000
+REQUEST_METRICS_SQL_LIMIT = 10
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROMETHEUS_FLUSH_INTERVAL = 1.0
+SEED_SKEW = 1.1
+BENCHMARK_REPEAT = 20
+BENCHMARK_TOLERANCE = 0.5
+BENCHMARK_BASELINE = 'benchmark_baseline.json'
+IMPORT_BATCH_SIZE = 1000
+IMPORT_COPY_THRESHOLD = 8 * 1024 * 1024
+IMPORT_READ_CHUNK = 64 * 1024
+TOKEN_CACHE_SIZE = 10000
+BENCHMARK_CONCURRENCY = 200
+BENCHMARK_DURATION = 10.0
+BENCHMARK_HTTP_TIMEOUT = 30
+RANKING_POPULAR = 'popular'
+RANKING_TRENDING = 'trending'
+POPULAR_HALF_LIFE = 30 * 24 * 60 * 60
+TRENDING_HALF_LIFE = 2 * 24 * 60 * 60
+RANKING_FAVORITE_WEIGHT = 1
+RANKING_CART_WEIGHT = 2
+RANKING_MIN_EXPONENT = -1000
+RANKING_BATCH_SIZE = 1000
+SEED_HISTORY = 30 * 24 * 60 * 60
+CACHE_VERSION_BATCH_SIZE = 1000
+CACHE_VERSION_LOCAL_SIZE = 10000
@@ -0,0 +1,45 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def update_counter(model, pks, field, delta, **values):
+    """Атомарно изменяет счетчик field записей model одним UPDATE.
+
+    values - другие поля, записываемые тем же UPDATE.
+    """
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, Value(0))}, **values
+    )
+
+
+def count_subquery(queryset, field):
+    """Подзапрос с количеством строк queryset, где field = OuterRef('pk')."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(count=Count('pk')).values('count')
+    ), Value(0))
+
+
+class CounterFieldsMixin:
+    """Не перезаписывает счетчики при обычном save().
+
+    Счетчики меняются только update_counter выражениями F(), а объект
+    в памяти может хранить их устаревшие значения. Без явного
+    update_fields сохраняются все загруженные поля, кроме counter_fields.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (kwargs.get('update_fields') is None and not args
+                and not kwargs.get('force_insert')
+                and not self._state.adding):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
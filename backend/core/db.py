@@ -0,0 +1,50 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул потоков для запросов к базе из async-кода.
+
+    Размер пула ограничивает число одновременных соединений
+    процесса с базой, остальные запросы ждут в очереди пула.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_DB_WORKERS,
+                thread_name_prefix='db'
+            )
+    return _executor
+
+
+def run_in_connection(func, *args, **kwargs):
+    """Выполняет func как отдельный запрос к базе в текущем потоке.
+
+    Как request_started и request_finished для обычных view,
+    закрывает соединения потока с ошибками и старше CONN_MAX_AGE.
+    """
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """Синхронная func в пуле get_executor с контекстом вызывающего."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(),
+        functools.partial(context.run, run_in_connection, func,
+                          *args, **kwargs)
+    )
@@ -0,0 +1,168 @@
+import contextvars
+import functools
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+from rest_framework.serializers import BaseSerializer
+
+from core.constants import REQUEST_METRICS_SAMPLES, REQUEST_METRICS_SQL_LIMIT
+
+current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class RequestMetrics:
+    """Счетчики одного запроса: SQL, соединение с базой, сериализация,
+    рендер, размер."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total_time = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.connect_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.size = None
+        self.serializing = False
+        self.slowest_sql = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Обертка connection.execute_wrapper, замеряющая каждый запрос."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            item = (duration, self.queries, sql)
+            if len(self.slowest_sql) < REQUEST_METRICS_SQL_LIMIT:
+                heapq.heappush(self.slowest_sql, item)
+            else:
+                heapq.heappushpop(self.slowest_sql, item)
+
+    def finish(self, response, size=None):
+        """Фиксирует время и размер ответа, потокового - по size."""
+        self.total_time = time.perf_counter() - self.started
+        self.size = size if response.streaming else len(response.content)
+
+    def as_dict(self):
+        return {
+            'total_ms': self.total_time * 1000,
+            'db_ms': self.db_time * 1000,
+            'connect_ms': self.connect_time * 1000,
+            'serializer_ms': self.serializer_time * 1000,
+            'render_ms': self.render_time * 1000,
+            'queries': self.queries,
+            'size': self.size,
+        }
+
+    def server_timing(self):
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} SQL"',
+            f'conn;dur={self.connect_time * 1000:.1f}',
+            f'serializer;dur={self.serializer_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={self.total_time * 1000:.1f}',
+        ))
+
+    def get_slowest_sql(self):
+        return [
+            (duration * 1000, sql)
+            for duration, _, sql in sorted(self.slowest_sql, reverse=True)
+        ]
+
+
+def track_current_queries(execute, sql, params, many, context):
+    """execute_wrapper, передающий запрос в метрики текущего запроса.
+
+    Метрики берутся из contextvar, поэтому запросы учитываются
+    в любом потоке, куда передан контекст запроса: в потоке
+    синхронного кода ASGI и в пуле core.db.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.execute_wrapper(execute, sql, params, many, context)
+
+
+def install_query_tracking(connection, **kwargs):
+    """Подключает track_current_queries к соединению один раз."""
+    if track_current_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_current_queries)
+
+
+def timed_serializer_data(fget):
+    """Учитывает время BaseSerializer.data в метриках текущего запроса.
+
+    Вложенные сериализаторы не учитываются повторно.
+    """
+
+    @functools.wraps(fget)
+    def data(self):
+        metrics = current_metrics.get()
+        if metrics is None or metrics.serializing:
+            return fget(self)
+        metrics.serializing = True
+        started = time.perf_counter()
+        try:
+            return fget(self)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics.serializing = False
+
+    data.timed = True
+    return data
+
+
+def install_serializer_timing():
+    if not getattr(BaseSerializer.data.fget, 'timed', False):
+        BaseSerializer.data = property(
+            timed_serializer_data(BaseSerializer.data.fget)
+        )
+
+
+def percentile(values, percent):
+    """Процентиль методом ближайшего ранга по отсортированным values."""
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+class RequestStats:
+    """Последние REQUEST_METRICS_SAMPLES замеров каждого view в процессе."""
+
+    def __init__(self, size=REQUEST_METRICS_SAMPLES):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=size))
+
+    def add(self, view, metrics):
+        with self._lock:
+            self._samples[view].append(metrics.as_dict())
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        with self._lock:
+            samples = {view: list(items)
+                       for view, items in self._samples.items()}
+        summary = {}
+        for view, items in sorted(samples.items()):
+            summary[view] = {'count': len(items)}
+            for field in items[0]:
+                values = sorted(item[field] for item in items
+                                if item[field] is not None)
+                if values:
+                    summary[view][field] = {
+                        f'p{percent}': round(percentile(values, percent), 3)
+                        for percent in PERCENTILES
+                    }
+        return summary
+
+
+request_stats = RequestStats()
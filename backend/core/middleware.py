@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from core.metrics import (RequestMetrics, current_metrics,
+                          install_query_tracking, install_serializer_timing,
+                          request_stats)
+from core.prometheus import metrics_store
+
+logger = logging.getLogger('foodgram.requests')
+
+
+class MeteredStream:
+    """Содержимое потокового ответа, замеряемое до конца отдачи.
+
+    SQL генератора выполняется уже после выхода из middleware, поэтому
+    замеры запроса активны на каждом шаге итерации, а записываются
+    после последнего куска или при закрытии ответа (обрыв соединения).
+    """
+
+    def __init__(self, content, metrics, on_finish):
+        self.content = content
+        self.iterator = iter(content)
+        self.metrics = metrics
+        self.on_finish = on_finish
+        self.size = 0
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = current_metrics.set(self.metrics)
+        try:
+            chunk = next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            current_metrics.reset(token)
+        self.size += len(chunk)
+        return chunk
+
+    def close(self):
+        if self.finished:
+            return
+        self.finished = True
+        close = getattr(self.content, 'close', None)
+        if close is not None:
+            close()
+        self.on_finish(self.size)
+
+
+class RequestMetricsMiddleware:
+    """Замеряет SQL, сериализацию и рендер каждого запроса.
+
+    С настройкой REQUEST_METRICS добавляет заголовок Server-Timing,
+    копит замеры по view для /api/stats/ и пишет в лог запросы
+    медленнее REQUEST_METRICS_SLOW_MS или с числом SQL больше
+    REQUEST_METRICS_SLOW_QUERIES вместе с самыми долгими запросами.
+    С настройкой PROMETHEUS_METRICS передает замеры в /api/metrics.
+    Работает и под WSGI, и под ASGI без перехода в синхронный поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not (settings.REQUEST_METRICS or settings.PROMETHEUS_METRICS):
+            raise MiddlewareNotUsed
+        install_serializer_timing()
+        connection_created.connect(install_query_tracking)
+        for connection in connections.all():
+            install_query_tracking(connection)
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так Django помечает асинхронные middleware-классы.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.process_metrics(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.process_metrics(request, response, metrics)
+
+    def process_metrics(self, request, response, metrics):
+        if response.streaming:
+            # Server-Timing не добавляется: заголовки уходят до SQL тела.
+            response.streaming_content = MeteredStream(
+                response.streaming_content, metrics,
+                lambda size: self.record(request, response, metrics, size)
+            )
+            return response
+        self.record(request, response, metrics)
+        if settings.REQUEST_METRICS:
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    def record(self, request, response, metrics, size=None):
+        metrics.finish(response, size)
+        if settings.PROMETHEUS_METRICS:
+            self.export(request, response, metrics)
+        if settings.REQUEST_METRICS:
+            view = self.get_view_name(request)
+            request_stats.add(view, metrics)
+            if self.is_slow(metrics):
+                self.log_slow(request, view, metrics)
+
+    def process_template_response(self, request, response):
+        metrics = current_metrics.get()
+        started = time.perf_counter()
+
+        def finish_render(response):
+            metrics.render_time += time.perf_counter() - started
+
+        if metrics is not None:
+            response.add_post_render_callback(finish_render)
+        return response
+
+    @staticmethod
+    def get_view_name(request):
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else 'unresolved'
+        return f'{request.method} {name}'
+
+    @staticmethod
+    def get_view_label(request):
+        """Класс DRF view и действие, например RecipesViewSet.list."""
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        view_class = getattr(match.func, 'cls', None)
+        if view_class is None:
+            return match.view_name or match.func.__name__
+        actions = getattr(match.func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{view_class.__name__}.{action}'
+
+    def export(self, request, response, metrics):
+        view = self.get_view_label(request)
+        metrics_store.inc('foodgram_requests_total', {
+            'view': view,
+            'method': request.method,
+            'status': response.status_code,
+        })
+        metrics_store.observe('foodgram_request_duration_seconds',
+                              {'view': view}, metrics.total_time)
+        metrics_store.inc('foodgram_db_queries_total', {'view': view},
+                          metrics.queries)
+        metrics_store.inc('foodgram_db_duration_seconds_total',
+                          {'view': view}, metrics.db_time)
+
+    @staticmethod
+    def is_slow(metrics):
+        return (metrics.total_time * 1000 > settings.REQUEST_METRICS_SLOW_MS
+                or metrics.queries > settings.REQUEST_METRICS_SLOW_QUERIES)
+
+    @staticmethod
+    def log_slow(request, view, metrics):
+        statements = '\n'.join(
+            f'  {duration:.1f} мс: {sql}'
+            for duration, sql in metrics.get_slowest_sql()
+        )
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.1f мс, SQL %s за %.1f мс\n%s',
+            request.method, request.get_full_path(), view,
+            metrics.total_time * 1000, metrics.queries,
+            metrics.db_time * 1000, statements
+        )
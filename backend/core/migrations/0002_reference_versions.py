@@ -0,0 +1,21 @@
+from django.db import migrations
+
+# Справочники сразу получают версию, а с ней и Last-Modified.
+FILL_VERSIONS_SQL = '''
+INSERT INTO core_cacheversion (key, version)
+SELECT key, (extract(epoch FROM now()) * 1000000000)::bigint
+FROM (VALUES ('version:recipes.tag'),
+             ('version:recipes.ingredient')) AS versions (key)
+ON CONFLICT (key) DO NOTHING;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FILL_VERSIONS_SQL, migrations.RunSQL.noop),
+    ]
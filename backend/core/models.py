@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class CacheVersion(models.Model):
+    """Версия закэшированных данных, общая для всех процессов.
+
+    Хранится в базе, а не в кэше Django: кэш по умолчанию свой
+    у каждого процесса, и сброс из команды управления или другого
+    воркера иначе не доходил бы до остальных.
+    """
+
+    key = models.CharField(
+        max_length=255,
+        primary_key=True,
+        verbose_name='Ключ'
+    )
+    version = models.BigIntegerField(
+        verbose_name='Версия'
+    )
+
+    class Meta:
+        verbose_name = 'Версия кэша'
+        verbose_name_plural = 'Версии кэша'
+
+    def __str__(self):
+        return f'{self.key}: {self.version}'
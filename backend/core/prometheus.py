@@ -0,0 +1,266 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+from core.constants import PROMETHEUS_BUCKETS, PROMETHEUS_FLUSH_INTERVAL
+
+METRICS = {
+    'foodgram_requests_total': (
+        'counter', 'Число запросов по view, методу и статусу.'
+    ),
+    'foodgram_request_duration_seconds': (
+        'histogram', 'Время ответа по view.'
+    ),
+    'foodgram_db_queries_total': (
+        'counter', 'Число SQL-запросов по view.'
+    ),
+    'foodgram_db_duration_seconds_total': (
+        'counter', 'Суммарное время SQL-запросов по view.'
+    ),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшам: попадания и промахи.'
+    ),
+    'foodgram_db_connections_total': (
+        'counter', 'Соединения с базой: открытые, из пула, повторно '
+                   'использованные, неисправные и таймауты пула.'
+    ),
+    'foodgram_db_pool_wait_seconds': (
+        'histogram', 'Ожидание свободного соединения в пуле.'
+    ),
+}
+
+
+def get_labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_snapshot(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(path, data):
+    temporary = path.with_name(f'.{path.name}.tmp')
+    temporary.write_text(json.dumps(data))
+    os.replace(temporary, path)
+
+
+def merge_snapshots(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            merged = histograms.setdefault(
+                (name, tuple(map(tuple, labels))),
+                [[0] * len(PROMETHEUS_BUCKETS), 0.0, 0]
+            )
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+class MetricsStore:
+    """Счетчики и гистограммы Prometheus в памяти процесса.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR, каждый процесс не чаще раза
+    в PROMETHEUS_FLUSH_INTERVAL секунд атомарно записывает свои
+    значения в файл <pid>-<время>.json, а collect суммирует файлы
+    всех процессов. Файлы завершившихся процессов collect переносит
+    в archive.json и удаляет: каталог не растет с перезапусками
+    воркеров, а счетчики не убывают.
+    """
+
+    archive_name = 'archive.json'
+    lock_name = '.lock'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.file_name = f'{self.pid}-{time.time_ns()}.json'
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.flush_timer = None
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._check_fork()
+            self.counters[name, get_labels_key(labels)] += value
+        self.schedule_flush()
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            self._check_fork()
+            key = (name, get_labels_key(labels))
+            histogram = self.histograms.setdefault(
+                key, [[0] * len(PROMETHEUS_BUCKETS), 0.0, 0]
+            )
+            for index, bound in enumerate(PROMETHEUS_BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self.schedule_flush()
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': [[name, labels, value] for (name, labels), value
+                             in self.counters.items()],
+                'histograms': [[name, labels, list(buckets), total, count]
+                               for (name, labels), (buckets, total, count)
+                               in self.histograms.items()],
+            }
+
+    def schedule_flush(self):
+        if not settings.PROMETHEUS_MULTIPROC_DIR:
+            return
+        with self._lock:
+            if self.flush_timer is not None:
+                return
+            self.flush_timer = threading.Timer(
+                PROMETHEUS_FLUSH_INTERVAL, self.flush
+            )
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        directory = Path(settings.PROMETHEUS_MULTIPROC_DIR)
+        data = self.snapshot()
+        with self._lock:
+            self.flush_timer = None
+        directory.mkdir(parents=True, exist_ok=True)
+        write_snapshot(directory / self.file_name, data)
+
+    def archive_dead(self, directory):
+        """Суммирует файлы завершившихся процессов в архив и удаляет их."""
+        dead = [
+            path for path in directory.glob('*-*.json')
+            if path.name.split('-')[0].isdigit()
+            and not is_alive(int(path.name.split('-')[0]))
+        ]
+        if not dead:
+            return
+        archive = directory / self.archive_name
+        snapshots = [
+            snapshot for snapshot in map(read_snapshot, [archive, *dead])
+            if snapshot is not None
+        ]
+        counters, histograms = merge_snapshots(snapshots)
+        write_snapshot(archive, {
+            'counters': [[name, labels, value] for (name, labels), value
+                         in counters.items()],
+            'histograms': [[name, labels, buckets, total, count]
+                           for (name, labels), (buckets, total, count)
+                           in histograms.items()],
+        })
+        for path in dead:
+            path.unlink()
+
+    def collect(self):
+        """Суммирует значения всех процессов."""
+        if not settings.PROMETHEUS_MULTIPROC_DIR:
+            return merge_snapshots([self.snapshot()])
+        self.flush()
+        directory = Path(settings.PROMETHEUS_MULTIPROC_DIR)
+        # Без блокировки другой процесс мог бы прочитать архив вместе
+        # с уже перенесенными в него файлами или перенести их дважды.
+        with open(directory / self.lock_name, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.archive_dead(directory)
+            snapshots = [
+                snapshot
+                for snapshot in map(read_snapshot, directory.glob('*.json'))
+                if snapshot is not None
+            ]
+        return merge_snapshots(snapshots)
+
+
+def format_labels(labels, **extra):
+    items = [*labels, *extra.items()]
+    if not items:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in items
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render_metrics(store):
+    """Текстовый формат экспозиции Prometheus 0.0.4."""
+    counters, histograms = store.collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(
+                    f'{name}{format_labels(labels)} {format_number(value)}'
+                )
+        for (metric, labels), (buckets, total, count) in sorted(
+            histograms.items()
+        ):
+            if metric != name:
+                continue
+            for bound, value in zip(PROMETHEUS_BUCKETS, buckets):
+                lines.append(f'{name}_bucket{format_labels(labels, le=bound)}'
+                             f' {value}')
+            lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")}'
+                         f' {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} '
+                         f'{format_number(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def record_cache(name, hit):
+    """Учитывает обращение к кэшу name."""
+    if settings.PROMETHEUS_METRICS:
+        metrics_store.inc('foodgram_cache_requests_total',
+                          {'cache': name, 'result': 'hit' if hit else 'miss'})
+
+
+def record_db_event(event, wait=None):
+    """Учитывает событие соединения с базой и ожидание пула."""
+    if settings.PROMETHEUS_METRICS:
+        metrics_store.inc('foodgram_db_connections_total', {'event': event})
+        if wait is not None:
+            metrics_store.observe('foodgram_db_pool_wait_seconds', {}, wait)
+
+
+metrics_store = MetricsStore()
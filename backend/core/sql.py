@@ -0,0 +1,160 @@
+from django.db import connections
+
+
+def insert_ignore(model, rows, returning, using='default'):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING одним запросом.
+
+    rows - список словарей {имя поля: значение} с одинаковыми ключами.
+    Возвращает значения поля returning только для вставленных строк,
+    строки, нарушающие уникальные ограничения, пропускаются.
+    """
+    if not rows:
+        return []
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    row_placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} '
+        f'({", ".join(quote(field.column) for field in fields)}) '
+        f'VALUES {", ".join([row_placeholders] * len(rows))} '
+        'ON CONFLICT DO NOTHING '
+        f'RETURNING {quote(model._meta.get_field(returning).column)}'
+    )
+    params = [
+        field.get_db_prep_save(row[field.name], connection)
+        for row in rows
+        for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [value for value, in cursor.fetchall()]
+
+
+def delete_returning(model, returning, using='default', **conditions):
+    """DELETE ... WHERE поле IN (...) RETURNING одним запросом.
+
+    Значения conditions - списки допустимых значений поля.
+    Возвращает значения поля returning для удаленных строк.
+    """
+    if not all(conditions.values()):
+        return []
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    where = []
+    params = []
+    for name, values in conditions.items():
+        field = model._meta.get_field(name)
+        where.append('{} IN ({})'.format(
+            quote(field.column), ', '.join(['%s'] * len(values))
+        ))
+        params += [field.get_db_prep_value(value, connection)
+                   for value in values]
+    sql = (
+        f'DELETE FROM {quote(model._meta.db_table)} '
+        f'WHERE {" AND ".join(where)} '
+        f'RETURNING {quote(model._meta.get_field(returning).column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [value for value, in cursor.fetchall()]
+
+
+def get_upsert_clause(model, conflict_fields, update_fields, connection):
+    """ON CONFLICT ... DO UPDATE только для действительно измененных строк.
+
+    Без update_fields конфликтующие строки пропускаются.
+    """
+    quote = connection.ops.quote_name
+    conflict = ', '.join(
+        quote(model._meta.get_field(name).column) for name in conflict_fields
+    )
+    if not update_fields:
+        return f'ON CONFLICT ({conflict}) DO NOTHING'
+    table = quote(model._meta.db_table)
+    columns = [quote(model._meta.get_field(name).column)
+               for name in update_fields]
+    assignments = ', '.join(
+        f'{column} = EXCLUDED.{column}' for column in columns
+    )
+    changed = ' OR '.join(
+        f'{table}.{column} <> EXCLUDED.{column}' for column in columns
+    )
+    return (f'ON CONFLICT ({conflict}) DO UPDATE SET {assignments} '
+            f'WHERE {changed}')
+
+
+def upsert(model, rows, conflict_fields, update_fields=(), using='default'):
+    """INSERT ... ON CONFLICT (conflict_fields) DO UPDATE одним запросом.
+
+    Аналог bulk_create(update_conflicts=True), которого нет в Django 3.2.
+    rows - список словарей {имя поля: значение} с одинаковыми ключами
+    без повторов по conflict_fields. Возвращает число вставленных
+    и измененных строк, совпадающие с таблицей строки не переписываются.
+    """
+    if not rows:
+        return 0
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    row_placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} '
+        f'({", ".join(quote(field.column) for field in fields)}) '
+        f'VALUES {", ".join([row_placeholders] * len(rows))} '
+        + get_upsert_clause(model, conflict_fields, update_fields, connection)
+    )
+    params = [
+        field.get_db_prep_save(row[field.name], connection)
+        for row in rows
+        for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def copy_upsert(model, file, field_names, conflict_fields,
+                update_fields=(), using='default'):
+    """Загружает CSV без заголовка через COPY во временную таблицу
+    и переносит строки в таблицу модели одним INSERT ... SELECT.
+
+    Только для PostgreSQL. Значения очищаются от пробелов по краям,
+    строки с пустыми значениями пропускаются, из повторов по
+    conflict_fields берется последний. Возвращает число прочитанных
+    строк и число вставленных и измененных.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    columns = [quote(model._meta.get_field(name).column)
+               for name in field_names]
+    keys = [quote(model._meta.get_field(name).column)
+            for name in conflict_fields]
+    column_list = ', '.join(columns)
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS import_staging')
+        cursor.execute(
+            'CREATE TEMPORARY TABLE import_staging (line bigserial, '
+            + ', '.join(f'{column} text' for column in columns) + ')'
+        )
+        cursor.copy_expert(
+            f'COPY import_staging ({column_list}) FROM STDIN '
+            'WITH (FORMAT csv)', file
+        )
+        cursor.execute('SELECT count(*) FROM import_staging')
+        read, = cursor.fetchone()
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} ({column_list}) '
+            f'SELECT DISTINCT ON ({", ".join(keys)}) {column_list} '
+            'FROM (SELECT line, '
+            + ', '.join(f'btrim({column}) AS {column}' for column in columns)
+            + ' FROM import_staging) AS staged WHERE '
+            + ' AND '.join(f"coalesce({column}, '') <> ''"
+                           for column in columns)
+            + f' ORDER BY {", ".join(keys)}, line DESC '
+            + get_upsert_clause(model, conflict_fields, update_fields,
+                                connection)
+        )
+        written = cursor.rowcount
+        cursor.execute('DROP TABLE import_staging')
+    return read, written
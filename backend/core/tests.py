@@ -0,0 +1,235 @@
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.core.signals import request_finished
+from django.db import OperationalError, close_old_connections, connection
+from django.http import StreamingHttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+
+from core.backends.postgresql import base
+from core.metrics import request_stats
+from core.middleware import RequestMetricsMiddleware
+from core.prometheus import MetricsStore
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен PostgreSQL')
+class ConnectionTest(TransactionTestCase):
+    """Повторное использование, проверка и пул соединений."""
+
+    pool_size = 0
+
+    def setUp(self):
+        # Обработчики django.contrib.postgres ищут псевдоним в connections.
+        self.alias = connection.alias
+        self.wrappers = []
+        self.addCleanup(self.close_all)
+
+    def close_all(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+        pool = base._pools.pop(self.alias, None)
+        if pool is not None:
+            for raw in pool._idle:
+                raw.close()
+
+    def make_wrapper(self, **settings):
+        settings_dict = {
+            **connection.settings_dict,
+            'CONN_MAX_AGE': 60,
+            'CONN_HEALTH_CHECKS': True,
+            'POOL_SIZE': self.pool_size,
+            'POOL_TIMEOUT': 0.1,
+            **settings,
+        }
+        wrapper = base.DatabaseWrapper(settings_dict, self.alias)
+        self.wrappers.append(wrapper)
+        return wrapper
+
+    @staticmethod
+    def finish_request(wrapper):
+        """То же, что делает Django по сигналу request_finished."""
+        wrapper.close_if_unusable_or_obsolete()
+
+    @staticmethod
+    def terminate(raw):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)',
+                           [raw.get_backend_pid()])
+
+    @staticmethod
+    def select_one(wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            return cursor.fetchone()[0]
+
+    def test_connection_reused(self):
+        wrapper = self.make_wrapper()
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        self.finish_request(wrapper)
+        self.assertEqual(self.select_one(wrapper), 1)
+        self.assertIs(wrapper.connection, raw)
+
+    def test_broken_connection_replaced(self):
+        wrapper = self.make_wrapper()
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        self.finish_request(wrapper)
+        self.terminate(raw)
+        self.assertEqual(self.select_one(wrapper), 1)
+        self.assertIsNot(wrapper.connection, raw)
+        self.assertTrue(raw.closed)
+
+
+class ConnectionPoolTest(ConnectionTest):
+
+    pool_size = 1
+
+    def test_connection_returned_to_pool(self):
+        first = self.make_wrapper()
+        first.ensure_connection()
+        raw = first.connection
+        self.finish_request(first)
+        self.assertIsNone(first.connection)
+        second = self.make_wrapper()
+        self.assertEqual(self.select_one(second), 1)
+        self.assertIs(second.connection, raw)
+
+    def test_pool_size_limit(self):
+        first = self.make_wrapper()
+        first.ensure_connection()
+        second = self.make_wrapper()
+        started = time.perf_counter()
+        with self.assertRaises(OperationalError):
+            second.ensure_connection()
+        self.assertGreaterEqual(time.perf_counter() - started, 0.1)
+        self.finish_request(first)
+        self.assertEqual(self.select_one(second), 1)
+
+    def test_waiting_for_returned_connection(self):
+        first = self.make_wrapper()
+        first.ensure_connection()
+        raw = first.connection
+        result = {}
+
+        def checkout():
+            second = self.make_wrapper(POOL_TIMEOUT=5)
+            try:
+                second.ensure_connection()
+                result['connection'] = second.connection
+            finally:
+                second.close()
+                self.wrappers.remove(second)
+
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        time.sleep(0.05)
+        self.finish_request(first)
+        thread.join(5)
+        self.assertIs(result.get('connection'), raw)
+
+    def test_broken_pooled_connection_discarded(self):
+        first = self.make_wrapper()
+        first.ensure_connection()
+        raw = first.connection
+        self.finish_request(first)
+        self.terminate(raw)
+        second = self.make_wrapper()
+        self.assertEqual(self.select_one(second), 1)
+        self.assertIsNot(second.connection, raw)
+        self.assertTrue(raw.closed)
+        self.assertEqual(base._pools[self.alias]._opened, 1)
+
+
+class MetricsStoreTest(SimpleTestCase):
+    """Файлы метрик завершившихся процессов переносятся в архив."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = override_settings(
+            PROMETHEUS_MULTIPROC_DIR=directory.name
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    @staticmethod
+    def get_dead_pid():
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return process.pid
+
+    def write_dead_worker(self, value):
+        path = self.directory / f'{self.get_dead_pid()}-1.json'
+        path.write_text(json.dumps({
+            'counters': [['foodgram_requests_total', [], value]],
+            'histograms': [],
+        }))
+        return path
+
+    def test_dead_workers_archived(self):
+        store = MetricsStore()
+        store.inc('foodgram_requests_total', {})
+        dead = [self.write_dead_worker(2), self.write_dead_worker(3)]
+        for _ in range(2):
+            counters, _ = store.collect()
+            self.assertEqual(counters['foodgram_requests_total', ()], 6)
+        self.assertFalse(any(path.exists() for path in dead))
+        self.assertEqual(
+            sorted(path.name for path in self.directory.glob('*.json')),
+            sorted([MetricsStore.archive_name, store.file_name])
+        )
+        self.write_dead_worker(4)
+        counters, _ = store.collect()
+        self.assertEqual(counters['foodgram_requests_total', ()], 10)
+
+
+@override_settings(REQUEST_METRICS=True, PROMETHEUS_METRICS=False)
+class StreamingMetricsTest(TestCase):
+    """SQL потокового ответа учитывается после отдачи тела."""
+
+    def setUp(self):
+        # Как тестовый клиент: закрытие ответа не закрывает соединение.
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+    @staticmethod
+    def lines():
+        for number in range(3):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT %s', [number])
+                yield f'{cursor.fetchone()[0]}\n'
+
+    def get_response(self):
+        middleware = RequestMetricsMiddleware(
+            lambda request: StreamingHttpResponse(self.lines())
+        )
+        return middleware(RequestFactory().get('/'))
+
+    def test_recorded_after_streaming(self):
+        with mock.patch.object(request_stats, 'add') as add:
+            response = self.get_response()
+            self.assertFalse(add.called)
+            self.assertEqual(b''.join(response), b'0\n1\n2\n')
+            response.close()
+        add.assert_called_once()
+        metrics = add.call_args[0][1]
+        self.assertEqual(metrics.queries, 3)
+        self.assertGreater(metrics.db_time, 0)
+        self.assertEqual(metrics.size, 6)
+
+    def test_recorded_on_close(self):
+        with mock.patch.object(request_stats, 'add') as add:
+            response = self.get_response()
+            next(iter(response))
+            response.close()
+        add.assert_called_once()
+        self.assertEqual(add.call_args[0][1].queries, 1)
@@ -35,7 +35,7 @@ class RecipesAdmin(admin.ModelAdmin):
 
     @admin.display(description='Добавили в избранное')
     def get_favorite(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(models.Tag)
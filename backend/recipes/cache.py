@@ -0,0 +1,135 @@
+import bisect
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.cache import (bump_versions, get_version, get_version_key,
+                        get_versions)
+from core.prometheus import record_cache
+from recipes.models import Ingredient, Tag
+
+
+class IngredientSearchCache:
+    """Кэш ингредиентов в памяти процесса для автодополнения.
+
+    Таблица ингредиентов меняется редко, поэтому она целиком
+    хранится в отсортированном по названию списке: совпадения
+    по префиксу ищутся бинарным поиском, по подстроке - перебором.
+    Кэш перечитывается, когда меняется версия таблицы Ingredient;
+    версия берется из памяти процесса или общего кэша, поэтому
+    нажатия клавиш не обращаются к базе.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = None
+        self._items = None
+        self._version = None
+
+    def _load(self):
+        items = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda item: item['name'].upper()
+        )
+        return [item['name'].upper() for item in items], items
+
+    def _get(self):
+        version = get_version(Ingredient)
+        with self._lock:
+            record_cache('ingredient_search', self._version == version)
+            if self._version != version:
+                self._names, self._items = self._load()
+                self._version = version
+            return self._names, self._items
+
+    def search(self, value, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        value = value.upper()
+        names, items = self._get()
+        result = []
+        index = bisect.bisect_left(names, value)
+        while (index < len(names) and len(result) < limit
+               and names[index].startswith(value)):
+            result.append(items[index])
+            index += 1
+        for name, item in zip(names, items):
+            if len(result) >= limit:
+                break
+            if value in name and not name.startswith(value):
+                result.append(item)
+        return result
+
+
+def get_recipe_version_key(recipe_id):
+    return f'version:recipe:{recipe_id}'
+
+
+def get_author_version_key(author_id):
+    return f'version:author:{author_id}'
+
+
+class RecipeFragmentCache:
+    """Общая для всех пользователей часть представления рецептов.
+
+    Фрагмент хранится под ключом из id рецепта и версий рецепта,
+    его автора и таблиц Tag и Ingredient: изменение любой из них
+    делает фрагмент недоступным, устаревшие ключи истекают сами
+    через RECIPE_CACHE_TIMEOUT.
+    """
+
+    def get_keys(self, recipes):
+        """Ключи фрагментов recipes: версии читаются одним запросом."""
+        table_keys = (get_version_key(Tag), get_version_key(Ingredient))
+        versions = get_versions([
+            *table_keys,
+            *{get_author_version_key(recipe.author_id) for recipe in recipes},
+            *(get_recipe_version_key(recipe.id) for recipe in recipes),
+        ])
+        tables = ':'.join(str(versions[key]) for key in table_keys)
+        return {
+            recipe.id: (
+                f'recipe_fragment:{recipe.id}:'
+                f'{versions[get_recipe_version_key(recipe.id)]}:'
+                f'{versions[get_author_version_key(recipe.author_id)]}:'
+                f'{tables}'
+            )
+            for recipe in recipes
+        }
+
+    def get_many(self, recipes, build):
+        """Фрагменты recipes по id рецепта.
+
+        Недостающие строятся одним вызовом build(ids) и сохраняются.
+        """
+        keys = self.get_keys(recipes)
+        cached = cache.get_many(keys.values())
+        fragments = {}
+        missing = []
+        for recipe_id, key in keys.items():
+            hit = key in cached
+            record_cache('recipe_fragment', hit)
+            if hit:
+                fragments[recipe_id] = cached[key]
+            else:
+                missing.append(recipe_id)
+        if missing:
+            built = build(missing)
+            cache.set_many(
+                {keys[recipe_id]: fragment
+                 for recipe_id, fragment in built.items()},
+                settings.RECIPE_CACHE_TIMEOUT
+            )
+            fragments.update(built)
+        return fragments
+
+    def invalidate(self, recipe_ids=(), author_ids=()):
+        """Сбрасывает фрагменты рецептов recipe_ids и авторов author_ids."""
+        bump_versions([
+            *map(get_recipe_version_key, recipe_ids),
+            *map(get_author_version_key, author_ids),
+        ])
+
+
+ingredient_search_cache = IngredientSearchCache()
+recipe_fragment_cache = RecipeFragmentCache()
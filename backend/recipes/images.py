@@ -0,0 +1,115 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from core.constants import IMAGE_THUMB_SIZE, IMAGE_WEBP_QUALITY
+from recipes.cache import recipe_fragment_cache
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул потоков для обработки фото, создаётся при первом обращении."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VARIANTS_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+    return _executor
+
+
+def is_variant_of(variant, image):
+    """Проверяет, что вариант построен из текущего файла фото."""
+    if not (variant and image):
+        return False
+    stem = os.path.splitext(os.path.basename(image.name))[0]
+    return os.path.basename(variant.name).startswith(stem)
+
+
+def has_variants(recipe):
+    return (is_variant_of(recipe.image_thumb, recipe.image)
+            and is_variant_of(recipe.image_webp, recipe.image))
+
+
+def encode_webp(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='WEBP', quality=IMAGE_WEBP_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def build_variants(pk):
+    """Строит миниатюру и WebP-копию фото рецепта pk.
+
+    Файлы сохраняются, только если за время обработки фото
+    не заменили; старые варианты удаляются из хранилища.
+    """
+    recipe = Recipe.objects.filter(pk=pk).only(
+        'image', 'image_thumb', 'image_webp'
+    ).first()
+    if recipe is None or not recipe.image or has_variants(recipe):
+        return
+    stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  else 'RGB')
+        webp = encode_webp(image)
+        image.thumbnail(IMAGE_THUMB_SIZE)
+        thumb = encode_webp(image)
+    storage = recipe.image.storage
+    stale = [recipe.image_thumb.name, recipe.image_webp.name]
+    names = {
+        'image_thumb': storage.save(
+            Recipe.image_thumb.field.generate_filename(
+                recipe, f'{stem}.webp'
+            ),
+            thumb
+        ),
+        'image_webp': storage.save(
+            Recipe.image_webp.field.generate_filename(
+                recipe, f'{stem}.webp'
+            ),
+            webp
+        ),
+    }
+    if Recipe.objects.filter(pk=pk, image=recipe.image.name).update(**names):
+        recipe_fragment_cache.invalidate(recipe_ids=[pk])
+        obsolete = stale
+    else:
+        obsolete = names.values()
+    for name in obsolete:
+        if name:
+            storage.delete(name)
+
+
+def run_build_variants(pk):
+    try:
+        build_variants(pk)
+    except Exception:
+        logger.exception('Не удалось обработать фото рецепта %s', pk)
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe):
+    """Ставит обработку фото в очередь после фиксации транзакции."""
+    if not settings.IMAGE_VARIANTS_ASYNC:
+        transaction.on_commit(lambda: build_variants(recipe.pk))
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(run_build_variants, recipe.pk)
+    )
@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+
+from recipes.images import build_variants, has_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры и WebP-копии фото рецептов'
+
+    def handle(self, *args, **options):
+        built = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'image', 'image_thumb', 'image_webp'
+        )
+        for recipe in recipes.iterator():
+            if not has_variants(recipe):
+                build_variants(recipe.pk)
+                built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано фото: {built}.'
+        ))
@@ -1,35 +1,178 @@
-from csv import DictReader
+import csv
+import itertools
+import json
+import re
+import time
+from pathlib import Path
 
-from django.core.management import BaseCommand
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from core.cache import bump_version
+from core.constants import (IMPORT_BATCH_SIZE, IMPORT_COPY_THRESHOLD,
+                            IMPORT_READ_CHUNK)
+from core.sql import copy_upsert, upsert
 from recipes.models import Ingredient, Tag
 
-
-models = {
-    Ingredient: 'ingredients.csv',
-    Tag: 'tags.csv'
+# Модель, поля уникального ключа и поля, обновляемые при повторном импорте.
+IMPORTS = {
+    'ingredients': (Ingredient, ('name', 'measurement_unit'), ()),
+    'tags': (Tag, ('slug',), ('name', 'color')),
 }
+FORMATS = ('.csv', '.json')
+JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_json(file, chunk_size=IMPORT_READ_CHUNK):
+    """Объекты JSON-массива или потока объектов (JSON Lines).
+
+    Файл читается кусками по chunk_size символов, в памяти
+    держится только текущий кусок.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        position = JSON_SEPARATORS.match(buffer, position).end()
+        if position < len(buffer):
+            if not started:
+                started = True
+                if buffer[position] == '[':
+                    position += 1
+                    continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                pass
+            else:
+                yield item
+                continue
+        chunk = file.read(chunk_size)
+        if not chunk:
+            if position < len(buffer):
+                raise CommandError(
+                    f'Некорректный JSON: {buffer[position:][:80]!r}'
+                )
+            return
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def batches(items, size):
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 class Command(BaseCommand):
-    help = 'Загружает данные из csv в базу'
+    help = ('Загружает ингредиенты и теги из CSV или JSON. Повторный '
+            'запуск добавляет новые строки и обновляет измененные')
 
-    def handle(self, *args, **options):
-        self.stdout.write('Идет заполнение базы данных:')
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*', type=Path,
+            help='Файлы .csv или .json, по умолчанию data/ingredients '
+                 'и data/tags.'
+        )
+        parser.add_argument(
+            '--model', choices=IMPORTS,
+            help='Куда загружать файлы, по умолчанию по имени файла.'
+        )
+        parser.add_argument('--batch-size', type=int,
+                            default=IMPORT_BATCH_SIZE)
+        parser.add_argument(
+            '--copy-threshold', type=int, default=IMPORT_COPY_THRESHOLD,
+            help='CSV больше этого размера в байтах загружаются '
+                 'в PostgreSQL через COPY.'
+        )
 
-        for model, csv_file in models.items():
+    def get_default_paths(self):
+        paths = []
+        for name in IMPORTS:
+            for suffix in FORMATS:
+                path = settings.BASE_DIR / 'data' / f'{name}{suffix}'
+                if path.exists():
+                    paths.append(path)
+                    break
+            else:
+                self.stderr.write(self.style.WARNING(
+                    f'Файл data/{name}.csv или data/{name}.json '
+                    'не найден, загрузка пропущена.'
+                ))
+        return paths
 
-            if model.objects.exists():
-                self.stdout.write(
-                    f'Заполнение модели {model.__name__} пропущено,'
-                    'так как таблица уже содержит записи.'
+    def handle(self, *args, **options):
+        self.stdout.write('Идет заполнение базы данных:')
+        for path in options['paths'] or self.get_default_paths():
+            name = options['model'] or path.stem
+            if name not in IMPORTS:
+                raise CommandError(
+                    f'Не удалось определить модель для {path}, '
+                    'укажите --model.'
                 )
-                continue
-            with open('data/' + csv_file, encoding='utf-8-sig') as file:
-                rows = DictReader(file)
-                records = [model(**row) for row in rows]
-                model.objects.bulk_create(records)
-
+            if path.suffix.lower() not in FORMATS:
+                raise CommandError(f'Формат {path} не поддерживается.')
+            if not path.exists():
+                raise CommandError(f'Файл {path} не найден.')
+            model = IMPORTS[name][0]
+            started = time.perf_counter()
+            with transaction.atomic():
+                read, written = self.import_file(path, *IMPORTS[name],
+                                                 options)
+            elapsed = time.perf_counter() - started
+            if written:
+                bump_version(model)
             self.stdout.write(self.style.SUCCESS(
-                f'заполнение модели {model.__name__} завершено.'
+                f'{path.name} -> {model.__name__}: прочитано {read}, '
+                f'добавлено или изменено {written} за {elapsed:.2f} с '
+                f'({read / max(elapsed, 1e-9):.0f} строк/с).'
             ))
+
+    def import_file(self, path, model, conflict_fields, update_fields,
+                    options):
+        fields = (*conflict_fields, *update_fields)
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            if path.suffix.lower() == '.json':
+                return self.import_rows(iter_json(file), model,
+                                        conflict_fields, update_fields,
+                                        options['batch_size'])
+            header = [name.strip() for name in next(csv.reader(file), [])]
+            use_copy = (
+                connection.vendor == 'postgresql'
+                and path.stat().st_size > options['copy_threshold']
+                and sorted(header) == sorted(fields)
+            )
+            if use_copy:
+                return copy_upsert(model, file, header, conflict_fields,
+                                   update_fields)
+            return self.import_rows(csv.DictReader(file, header), model,
+                                    conflict_fields, update_fields,
+                                    options['batch_size'])
+
+    @staticmethod
+    def import_rows(rows, model, conflict_fields, update_fields,
+                    batch_size):
+        """Пачками upsert-ит строки, пропуская неполные и повторы в пачке."""
+        fields = (*conflict_fields, *update_fields)
+        read = written = 0
+        for batch in batches(rows, batch_size):
+            read += len(batch)
+            unique = {}
+            for row in batch:
+                if not isinstance(row, dict):
+                    raise CommandError(f'Ожидался объект, получено {row!r}')
+                values = {field: str(row.get(field) or '').strip()
+                          for field in fields}
+                if all(values.values()):
+                    unique[tuple(values[field]
+                                 for field in conflict_fields)] = values
+            written += upsert(model, list(unique.values()),
+                              conflict_fields, update_fields)
+        return read, written
@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from core.counters import count_subquery
+from recipes.models import Favorite, Recipe, Shopping_Cart
+from users.models import User, UserSubscribe
+
+counters = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', Shopping_Cart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', UserSubscribe, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики'
+
+    def handle(self, *args, **options):
+        for model, field, related_model, related_field in counters:
+            actual = count_subquery(related_model.objects.all(),
+                                    related_field)
+            with transaction.atomic():
+                drifted = model.objects.annotate(actual=actual).exclude(
+                    **{field: F('actual')}
+                ).values('pk')
+                updated = model.objects.filter(pk__in=drifted).update(
+                    **{field: actual}
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'{model.__name__}.{field}: исправлено записей {updated}.'
+            ))
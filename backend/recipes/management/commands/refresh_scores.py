@@ -0,0 +1,59 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections, transaction
+
+from core.constants import RANKING_BATCH_SIZE
+from recipes.models import Recipe, RecipeScore
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинги рецептов для сортировки '
+            '?ordering=popular|trending')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать все рецепты, например после изменения '
+                 'периодов полураспада или весов.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=RANKING_BATCH_SIZE,
+            help='Рецептов в одной транзакции.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Повторять пересчет каждые interval секунд; '
+                 'по умолчанию - один раз.'
+        )
+
+    def refresh(self, full, batch_size):
+        started = time.perf_counter()
+        if full:
+            recipe_ids = Recipe.objects.values_list('id', flat=True)
+        else:
+            recipe_ids = RecipeScore.objects.stale()
+        recipe_ids = list(recipe_ids.order_by('id'))
+        updated = 0
+        for start in range(0, len(recipe_ids), batch_size):
+            with transaction.atomic():
+                updated += RecipeScore.objects.refresh(
+                    recipe_ids[start:start + batch_size]
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинги: проверено рецептов {len(recipe_ids)}, '
+            f'изменено {updated} за {time.perf_counter() - started:.2f} с.'
+        ))
+
+    def handle(self, *args, **options):
+        while True:
+            self.refresh(options['full'], options['batch_size'])
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,187 @@
+import itertools
+import random
+from contextlib import contextmanager
+from csv import DictReader
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand, call_command
+from django.db import transaction
+from django.utils import timezone
+
+from core.cache import bump_version
+from core.constants import SEED_BATCH_SIZE, SEED_HISTORY, SEED_SKEW
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            Shopping_Cart, Tag)
+from users.models import User, UserSubscribe
+
+DISHES = ('борщ', 'суп', 'салат', 'пирог', 'омлет', 'каша', 'котлеты',
+          'блины', 'плов', 'паста', 'рагу', 'запеканка', 'щи', 'пельмени')
+ADJECTIVES = ('домашний', 'быстрый', 'острый', 'сливочный', 'овощной',
+              'постный', 'праздничный', 'летний', 'бабушкин', 'лёгкий')
+ADDITIONS = ('с грибами', 'с курицей', 'с сыром', 'с говядиной',
+             'с картофелем', 'с томатами', 'с зеленью', 'с яблоками')
+TEXT_WORDS = ('нарезать', 'обжарить', 'варить', 'добавить', 'посолить',
+              'перемешать', 'запекать', 'подавать', 'горячим', 'духовке',
+              'сковороде', 'кастрюле', 'минут', 'масле', 'соусом')
+
+
+def popularity(population, skew, rnd):
+    """Перемешивает population и строит накопленные веса по закону Ципфа.
+
+    Несколько элементов получают большую часть выборок, как
+    популярные авторы и рецепты на настоящем сайте.
+    """
+    population = list(population)
+    rnd.shuffle(population)
+    return population, list(itertools.accumulate(
+        1 / (rank + 1) ** skew for rank in range(len(population))
+    ))
+
+
+@contextmanager
+def backdated(*fields):
+    """Отключает auto_now_add, чтобы bulk_create сохранил заданные даты."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def pick(rnd, population, cum_weights, count):
+    """До count разных элементов с учетом популярности."""
+    if not population or count <= 0:
+        return set()
+    return set(rnd.choices(population, cum_weights=cum_weights, k=count))
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими данными для замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов на пользователя '
+                                 'в среднем.')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Рецептов в списке покупок на пользователя '
+                                 'в среднем.')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок на пользователя в среднем.')
+        parser.add_argument('--skew', type=float, default=SEED_SKEW,
+                            help='Показатель распределения Ципфа для '
+                                 'популярности авторов, рецептов '
+                                 'и ингредиентов; 0 - равномерно.')
+        parser.add_argument('--random-seed', type=int, default=0)
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(
+            objects, batch_size=SEED_BATCH_SIZE, ignore_conflicts=True
+        )
+
+    def read_csv(self, file_name):
+        path = settings.BASE_DIR / 'data' / file_name
+        if not path.exists():
+            return []
+        with open(path, encoding='utf-8-sig') as file:
+            return list(DictReader(file))
+
+    def get_reference_data(self):
+        if not Tag.objects.exists():
+            rows = self.read_csv('tags.csv') or [
+                {'name': f'Тэг {index}', 'color': f'#0000{index:02d}',
+                 'slug': f'seed-tag-{index}'}
+                for index in range(5)
+            ]
+            self.bulk_create(Tag, [Tag(**row) for row in rows])
+            bump_version(Tag)
+        if not Ingredient.objects.exists():
+            rows = self.read_csv('ingredients.csv') or [
+                {'name': f'Ингредиент {index}', 'measurement_unit': 'г'}
+                for index in range(200)
+            ]
+            self.bulk_create(Ingredient, [Ingredient(**row) for row in rows])
+            bump_version(Ingredient)
+        return (list(Tag.objects.values_list('id', flat=True)),
+                list(Ingredient.objects.values_list('id', flat=True)))
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rnd = random.Random(options['random_seed'])
+        skew = options['skew']
+        tag_ids, ingredient_ids = self.get_reference_data()
+        offset = User.objects.count()
+        self.bulk_create(User, [
+            User(email=f'seed{index}@example.com',
+                 username=f'seed{index}',
+                 first_name='Seed', last_name=str(index),
+                 password='!')
+            for index in range(offset, offset + options['users'])
+        ])
+        user_ids = list(User.objects.values_list('id', flat=True))
+        authors, author_weights = popularity(user_ids, skew, rnd)
+        now = timezone.now()
+        with backdated(Recipe._meta.get_field('pub_date')):
+            self.bulk_create(Recipe, [
+                Recipe(author_id=author_id,
+                       name=(f'{rnd.choice(ADJECTIVES).capitalize()} '
+                             f'{rnd.choice(DISHES)} {rnd.choice(ADDITIONS)}'),
+                       text=' '.join(rnd.choices(TEXT_WORDS, k=30)),
+                       image='media/seed.png',
+                       cooking_time=rnd.randint(1, 180),
+                       pub_date=now - timedelta(
+                           seconds=rnd.uniform(0, SEED_HISTORY)
+                       ))
+                for author_id in rnd.choices(
+                    authors, cum_weights=author_weights, k=options['recipes']
+                )
+            ])
+        pub_dates = dict(Recipe.objects.values_list('id', 'pub_date'))
+        recipe_ids = list(pub_dates)
+        recipes, recipe_weights = popularity(recipe_ids, skew, rnd)
+        ingredients, ingredient_weights = popularity(
+            ingredient_ids, skew, rnd
+        )
+        self.bulk_create(RecipeIngredient, [
+            RecipeIngredient(recipes_id=recipe_id, ingredients_id=ingredient,
+                             amount=rnd.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient in pick(rnd, ingredients, ingredient_weights,
+                                   rnd.randint(3, 10))
+        ])
+        self.bulk_create(Recipe.tags.through, [
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag)
+            for recipe_id in recipe_ids
+            for tag in rnd.sample(tag_ids, min(len(tag_ids),
+                                               rnd.randint(1, 2)))
+        ])
+        for model, per_user in ((Favorite, options['favorites']),
+                                (Shopping_Cart, options['carts'])):
+            # Рецепт добавляют не раньше его публикации.
+            with backdated(model._meta.get_field('created')):
+                self.bulk_create(model, [
+                    model(author_id=user_id, recipe_id=recipe_id,
+                          created=pub_dates[recipe_id] + rnd.random() * max(
+                              now - pub_dates[recipe_id], timedelta()
+                          ))
+                    for user_id in user_ids
+                    for recipe_id in pick(rnd, recipes, recipe_weights,
+                                          rnd.randint(0, 2 * per_user))
+                ])
+        self.bulk_create(UserSubscribe, [
+            UserSubscribe(follower_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in pick(rnd, authors, author_weights,
+                                  rnd.randint(0, 2 * options['subscriptions']))
+            if author_id != user_id
+        ])
+        call_command('recount', stdout=self.stdout)
+        call_command('refresh_scores', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {options["users"]}, '
+            f'рецептов: {options["recipes"]}.'
+        ))
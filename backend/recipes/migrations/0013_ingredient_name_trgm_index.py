@@ -0,0 +1,20 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_auto_20240301_0457'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX recipes_ingredient_name_upper_trgm '
+                'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops);'
+            ),
+            reverse_sql='DROP INDEX recipes_ingredient_name_upper_trgm;',
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:12
+
+from django.db import migrations, models
+
+from core.counters import count_subquery
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    Shopping_Cart = apps.get_model('recipes', 'Shopping_Cart')
+    User = apps.get_model('users', 'User')
+    UserSubscribe = apps.get_model('users', 'UserSubscribe')
+    Recipe.objects.update(
+        favorites_count=count_subquery(Favorite.objects.all(), 'recipe'),
+        in_carts_count=count_subquery(Shopping_Cart.objects.all(), 'recipe'),
+    )
+    User.objects.update(
+        recipes_count=count_subquery(Recipe.objects.all(), 'author'),
+        followers_count=count_subquery(UserSubscribe.objects.all(), 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_ingredient_name_trgm_index'),
+        ('users', '0010_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавили в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавили в список покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
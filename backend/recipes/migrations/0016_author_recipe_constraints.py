@@ -0,0 +1,43 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:14
+
+from django.db import migrations, models
+from django.db.models import Min
+
+from core.counters import count_subquery
+
+
+def delete_duplicates(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for model_name, counter_field in (('Favorite', 'favorites_count'),
+                                      ('Shopping_Cart', 'in_carts_count')):
+        model = apps.get_model('recipes', model_name)
+        keep = model.objects.values('author', 'recipe').annotate(
+            first_id=Min('id')
+        ).values('first_id')
+        model.objects.exclude(id__in=keep).delete()
+        Recipe.objects.update(**{
+            counter_field: count_subquery(model.objects.all(), 'recipe')
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('author', 'recipe'), name='unique_favorite_author_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='shopping_cart',
+            constraint=models.UniqueConstraint(fields=('author', 'recipe'), name='unique_shopping_cart_author_recipe'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['ingredients', 'recipes'], name='recipe_ingredient_lookup_idx'),
+        ),
+    ]
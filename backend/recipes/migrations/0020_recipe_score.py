@@ -0,0 +1,62 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+from core.constants import POPULAR_HALF_LIFE, TRENDING_HALF_LIFE
+
+FILL_SCORES_SQL = f'''
+INSERT INTO recipes_recipescore
+    (recipe_id, popular, trending, favorites_count, in_carts_count)
+SELECT id,
+       extract(epoch FROM pub_date)::float8 / {POPULAR_HALF_LIFE},
+       extract(epoch FROM pub_date)::float8 / {TRENDING_HALF_LIFE},
+       0, 0
+FROM recipes_recipe;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_recipe_ingredient_lookup_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shopping_cart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('popular', models.FloatField(verbose_name='Популярность')),
+                ('trending', models.FloatField(verbose_name='Набирает популярность')),
+                ('favorites_count', models.PositiveIntegerField(default=0, verbose_name='Избранное при расчете')),
+                ('in_carts_count', models.PositiveIntegerField(default=0, verbose_name='Списки покупок при расчете')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-popular', '-recipe'], name='recipe_score_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-trending', '-recipe'], name='recipe_score_trending_idx'),
+        ),
+        migrations.RunSQL(FILL_SCORES_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.3 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+FILL_LAST_EVENT_SQL = '''
+UPDATE recipes_recipe AS recipe
+SET last_event = events.created
+FROM (
+    SELECT recipe_id, max(created) AS created
+    FROM (
+        SELECT recipe_id, created FROM recipes_favorite
+        UNION ALL
+        SELECT recipe_id, created FROM recipes_shopping_cart
+    ) AS events
+    GROUP BY recipe_id
+) AS events
+WHERE recipe.id = events.recipe_id;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_recipe_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='last_event',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Последнее добавление в избранное или покупки'),
+        ),
+        migrations.AddField(
+            model_name='recipescore',
+            name='last_event',
+            field=models.DateTimeField(null=True, verbose_name='Последнее добавление при расчете'),
+        ),
+        migrations.RunSQL(FILL_LAST_EVENT_SQL, migrations.RunSQL.noop),
+    ]
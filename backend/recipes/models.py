@@ -1,11 +1,27 @@
+from collections import defaultdict
+
 from colorfield.fields import ColorField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField,
+                                            TrigramSimilarity)
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import (BooleanField, Case, Count, Exists, F,
+                              FloatField, IntegerField, OuterRef, Prefetch, Q,
+                              Subquery, Sum, Value, When, Window)
+from django.db.models.functions import RowNumber
 
 from core.basemodel import AuthorRecipeModel
 from core.constants import (LENGTH_FOR_MEASUREMENT_UNIT, LENGTH_FOR_NAME,
-                            MAX_VALUE, MIN_VALUE, ROW_LIMIT_TO)
-from users.models import User
+                            MATCH_ALL, MATCH_MOST, MAX_VALUE, MIN_VALUE,
+                            POPULAR_HALF_LIFE, RANKING_CART_WEIGHT,
+                            RANKING_FAVORITE_WEIGHT, RANKING_MIN_EXPONENT,
+                            RANKING_POPULAR, RANKING_TRENDING, ROW_LIMIT_TO,
+                            SEARCH_CONFIG, TRENDING_HALF_LIFE)
+from core.counters import CounterFieldsMixin
+from core.sql import upsert
+from users.models import User, UserSubscribe
 
 
 class Ingredient(models.Model):
@@ -59,9 +75,185 @@ class Tag(models.Model):
         return self.name[:ROW_LIMIT_TO]
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов."""
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами избранного и списка покупок."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                author=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(Shopping_Cart.objects.filter(
+                author=user, recipe=OuterRef('pk')
+            ))
+        )
+
+    def with_viewer_flags(self, user):
+        """Флаги избранного, списка покупок и подписки на автора.
+
+        Все флаги рецептов страницы приходят в том же запросе,
+        что и сами рецепты, остальное берется из кэша фрагментов.
+        """
+        if not user.is_authenticated:
+            is_subscribed = Value(False, output_field=BooleanField())
+        else:
+            is_subscribed = Exists(UserSubscribe.objects.filter(
+                author=OuterRef('author'), follower=user
+            ))
+        return self.with_user_flags(user).annotate(
+            is_subscribed=is_subscribed
+        ).defer('search_vector')
+
+    def feed(self, user):
+        """Рецепты авторов, на которых подписан user."""
+        return self.filter(author__following__follower=user)
+
+    def search(self, value):
+        """Полнотекстовый поиск по названию и описанию с ранжированием.
+
+        Если по словам ничего не найдено (например, из-за опечатки),
+        ищет по триграммному сходству названия. Проверка совпадений
+        по словам - некоррелированный EXISTS в том же запросе,
+        PostgreSQL вычисляет его один раз.
+        """
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        matched = Q(search_vector=query)
+        return self.alias(
+            has_matches=Exists(self.filter(matched))
+        ).filter(
+            matched | Q(has_matches=False, name__trigram_similar=value)
+        ).annotate(search_rank=Case(
+            When(matched, then=SearchRank(F('search_vector'), query)),
+            default=TrigramSimilarity('name', value),
+            output_field=FloatField()
+        )).order_by_relevance()
+
+    def with_ingredients(self, ingredient_ids, match=MATCH_ALL):
+        """Рецепты, в которых есть ингредиенты ingredient_ids.
+
+        match: all - все ингредиенты, any - хотя бы один,
+        most - больше половины. Для any и most рецепты
+        ранжируются по числу совпавших ингредиентов.
+        """
+        ingredient_ids = set(ingredient_ids)
+        matches = RecipeIngredient.objects.filter(
+            ingredients__in=ingredient_ids
+        ).order_by().values('recipes').annotate(matched=Count('pk'))
+        if match == MATCH_ALL:
+            return self.filter(pk__in=Subquery(matches.filter(
+                matched=len(ingredient_ids)
+            ).values('recipes')))
+        if match == MATCH_MOST:
+            matches = matches.filter(matched__gt=len(ingredient_ids) // 2)
+        return self.filter(
+            pk__in=Subquery(matches.values('recipes'))
+        ).annotate(coverage=Subquery(
+            matches.filter(recipes=OuterRef('pk')).values('matched'),
+            output_field=IntegerField()
+        )).order_by_relevance()
+
+    def ranked(self, ordering):
+        """Рецепты по убыванию рейтинга ordering: popular или trending.
+
+        Порядок совпадает с индексом таблицы рейтингов, поэтому
+        страница выбирается без сортировки всех рецептов.
+        """
+        return self.filter(score__isnull=False).select_related(
+            'score'
+        ).order_by_relevance(ordering)
+
+    def order_by_relevance(self, ranking=None):
+        """Сортировка по аннотациям релевантности и рейтингу ranking.
+
+        Сначала рецепты с большим числом совпавших ингредиентов
+        (coverage), затем с большим рангом поиска (search_rank),
+        затем с большим рейтингом ranking, при равенстве - новые.
+        RecipeFilter вызывает его еще раз после всех фильтров, чтобы
+        их сортировки не заменяли друг друга.
+        """
+        ordering = [
+            f'-{name}' for name in ('coverage', 'search_rank')
+            if name in self.query.annotations
+        ]
+        if ranking:
+            ordering.append(f'-score__{ranking}')
+        else:
+            ordering.append('-pub_date')
+        return self.order_by(*ordering, '-id')
+
+    def for_read(self, user):
+        """Рецепты со всеми связями для ReadRecipeSerializer.
+
+        Число запросов не зависит от количества рецептов на странице.
+        """
+        return self.with_user_flags(user).defer(
+            'search_vector'
+        ).prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.with_is_subscribed(user)
+            ),
+            'tags',
+            Prefetch(
+                'recipesingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredients'
+                )
+            )
+        )
+
+    def for_fragments(self):
+        """Рецепты со связями для фрагментов без флагов пользователя."""
+        return self.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipesingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredients'
+                )
+            )
+        )
+
+    def previews_by_author(self, authors, limit=None):
+        """Последние limit рецептов каждого из authors одним запросом.
+
+        Возвращает словарь {id автора: [рецепты]}.
+        """
+        previews = defaultdict(list)
+        if not authors:
+            return previews
+        recipes = self.filter(author__in=authors)
+        if limit is not None:
+            ranked = recipes.annotate(row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc())
+            ))
+            sql, params = ranked.query.sql_with_params()
+            recipes = self.raw(
+                f'SELECT * FROM ({sql}) AS ranked '
+                'WHERE row_number <= %s ORDER BY row_number',
+                (*params, limit)
+            )
+        for recipe in recipes:
+            previews[recipe.author_id].append(recipe)
+        return previews
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель рецептов."""
 
+    counter_fields = ('favorites_count', 'in_carts_count', 'last_event')
+
     tags = models.ManyToManyField(
         Tag,
         related_name='recipes',
@@ -77,6 +269,18 @@ class Recipe(models.Model):
         upload_to='media/',
         verbose_name='Фото'
     )
+    image_thumb = models.ImageField(
+        upload_to='media/thumbs/',
+        blank=True,
+        editable=False,
+        verbose_name='Миниатюра'
+    )
+    image_webp = models.ImageField(
+        upload_to='media/webp/',
+        blank=True,
+        editable=False,
+        verbose_name='Фото в WebP'
+    )
     name = models.CharField(
         max_length=LENGTH_FOR_NAME,
         verbose_name='Название'
@@ -107,16 +311,193 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавили в избранное'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавили в список покупок'
+    )
+    last_event = models.DateTimeField(
+        null=True,
+        editable=False,
+        verbose_name='Последнее добавление в избранное или покупки'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('author', '-pub_date'),
+                         name='recipe_author_pub_date_idx'),
+            GinIndex(fields=('search_vector',),
+                     name='recipe_search_vector_idx'),
+            GinIndex(fields=('name',), opclasses=('gin_trgm_ops',),
+                     name='recipe_name_trgm_idx'),
+        )
 
     def __str__(self):
         return self.name[:ROW_LIMIT_TO]
 
 
+class RecipeScoreQuerySet(models.QuerySet):
+    """Набор запросов для рейтингов рецептов."""
+
+    half_lives = {
+        RANKING_POPULAR: POPULAR_HALF_LIFE,
+        RANKING_TRENDING: TRENDING_HALF_LIFE,
+    }
+
+    def stale(self):
+        """id рецептов без рейтинга или с событиями после расчета.
+
+        Удаления видны по счетчикам, добавления - по last_event: иначе
+        удаление и новое добавление между расчетами не меняли бы счетчик.
+        """
+        return Recipe.objects.filter(
+            Q(score__isnull=True)
+            | ~Q(score__favorites_count=F('favorites_count'))
+            | ~Q(score__in_carts_count=F('in_carts_count'))
+            | Q(score__last_event__lt=F('last_event'))
+            | Q(score__last_event__isnull=True, last_event__isnull=False)
+        ).values_list('id', flat=True)
+
+    def get_score_sql(self, half_life):
+        """log2 суммы weight * 2 ** (time / half_life) по событиям.
+
+        Из показателей вынесено время последнего события, поэтому
+        степени не переполняются, а очень старые события дают 0.
+        """
+        return (
+            f'max(latest) / {half_life} + ln(sum(weight * power(2, '
+            f'greatest((time - latest) / {half_life}, '
+            f'{RANKING_MIN_EXPONENT})))) / ln(2)'
+        )
+
+    def refresh(self, recipe_ids):
+        """Пересчитывает рейтинги рецептов recipe_ids.
+
+        Событиями считаются публикация, добавления в избранное и в список
+        покупок. Возвращает число вставленных и измененных рейтингов.
+        """
+        if not recipe_ids:
+            return 0
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        recipes = quote(Recipe._meta.db_table)
+        scores = ', '.join(
+            self.get_score_sql(half_life)
+            for half_life in self.half_lives.values()
+        )
+        sql = (
+            f'SELECT recipe.id, {scores}, '
+            'recipe.favorites_count, recipe.in_carts_count, '
+            'recipe.last_event '
+            'FROM (SELECT recipe_id, weight, time, '
+            'max(time) OVER (PARTITION BY recipe_id) AS latest '
+            f'FROM (SELECT id AS recipe_id, 1 AS weight, '
+            f'extract(epoch FROM pub_date)::float8 AS time FROM {recipes} '
+            'WHERE id = ANY(%(ids)s) '
+            f'UNION ALL SELECT recipe_id, {RANKING_FAVORITE_WEIGHT}, '
+            'extract(epoch FROM created)::float8 '
+            f'FROM {quote(Favorite._meta.db_table)} '
+            'WHERE recipe_id = ANY(%(ids)s) '
+            f'UNION ALL SELECT recipe_id, {RANKING_CART_WEIGHT}, '
+            'extract(epoch FROM created)::float8 '
+            f'FROM {quote(Shopping_Cart._meta.db_table)} '
+            'WHERE recipe_id = ANY(%(ids)s)) AS events) AS events '
+            f'JOIN {recipes} AS recipe ON recipe.id = events.recipe_id '
+            'GROUP BY recipe.id'
+        )
+        fields = ('recipe', *self.half_lives,
+                  'favorites_count', 'in_carts_count', 'last_event')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {'ids': list(recipe_ids)})
+            rows = [dict(zip(fields, row)) for row in cursor.fetchall()]
+        return upsert(self.model, rows, ('recipe',), fields[1:], self.db)
+
+
+class RecipeScore(models.Model):
+    """Рейтинг рецепта для сортировки ?ordering=popular|trending.
+
+    Каждое событие весит weight * 2 ** (время события / период
+    полураспада), рейтинг - log2 суммы весов. Порядок такой же, как
+    у суммы весов, затухающих к текущему моменту, но со временем
+    рейтинги не устаревают: команда refresh_scores пересчитывает только
+    рецепты, у которых изменились счетчики избранного и покупок
+    или время последнего добавления.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт'
+    )
+    popular = models.FloatField(
+        verbose_name='Популярность'
+    )
+    trending = models.FloatField(
+        verbose_name='Набирает популярность'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Избранное при расчете'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Списки покупок при расчете'
+    )
+    last_event = models.DateTimeField(
+        null=True,
+        verbose_name='Последнее добавление при расчете'
+    )
+
+    objects = RecipeScoreQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = (
+            models.Index(fields=('-popular', '-recipe'),
+                         name='recipe_score_popular_idx'),
+            models.Index(fields=('-trending', '-recipe'),
+                         name='recipe_score_trending_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.popular:.2f} / {self.trending:.2f}'
+
+
+class RecipeIngredientQuerySet(models.QuerySet):
+    """Набор запросов для ингредиентов рецептов."""
+
+    def shopping_list(self, user):
+        """Суммирует ингредиенты рецептов из списка покупок user."""
+        return self.filter(
+            recipes__shopping_list__author=user.id
+        ).values(
+            name=F('ingredients__name'),
+            measurement_unit=F('ingredients__measurement_unit')
+        ).annotate(
+            amount=Sum('amount')
+        ).order_by('name')
+
+
 class RecipeIngredient(models.Model):
     """Промежуточная модель для Рецептов и Игредиентов."""
 
@@ -144,11 +525,17 @@ class RecipeIngredient(models.Model):
         ],
     )
 
+    objects = RecipeIngredientQuerySet.as_manager()
+
     class Meta:
         constraints = (
             models.UniqueConstraint(fields=('recipes', 'ingredients',),
                                     name='unique_recipe_with_ingredients'),
         )
+        indexes = (
+            models.Index(fields=('ingredients', 'recipes'),
+                         name='recipe_ingredient_lookup_idx'),
+        )
         ordering = ['recipes']
         verbose_name = 'Игредиент'
         verbose_name_plural = 'Количество ингридиентов'
@@ -160,6 +547,8 @@ class RecipeIngredient(models.Model):
 class Shopping_Cart(AuthorRecipeModel):
     """Модель для добавления рецепта в список покупок."""
 
+    counter_field = 'in_carts_count'
+
     class Meta(AuthorRecipeModel.Meta):
         default_related_name = 'shopping_list'
         verbose_name = 'Список покупок'
@@ -169,6 +558,8 @@ class Shopping_Cart(AuthorRecipeModel):
 class Favorite(AuthorRecipeModel):
     """Модель для добавления рецепта в избранное."""
 
+    counter_field = 'favorites_count'
+
     class Meta(AuthorRecipeModel.Meta):
         default_related_name = 'favorites'
         verbose_name = 'Избранное'
@@ -0,0 +1,92 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from core.cache import bump_version, invalidate_author_feeds
+from core.counters import update_counter
+from recipes.cache import recipe_fragment_cache
+from recipes.images import has_variants, schedule_variants
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeScore, Shopping_Cart, Tag)
+from users.models import User
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Tag)
+def bump_reference_version(sender, **kwargs):
+    bump_version(sender)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Shopping_Cart)
+def increase_recipe_counter(sender, instance, created, **kwargs):
+    if created:
+        update_counter(Recipe, [instance.recipe_id], sender.counter_field, 1,
+                       last_event=instance.created)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Shopping_Cart)
+def decrease_recipe_counter(sender, instance, **kwargs):
+    update_counter(Recipe, [instance.recipe_id], sender.counter_field, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        update_counter(User, [instance.author_id], 'recipes_count', 1)
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_followers_feeds(sender, instance, created, **kwargs):
+    if created:
+        invalidate_author_feeds([instance.author_id])
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(sender, instance, created, **kwargs):
+    if created:
+        RecipeScore.objects.refresh([instance.id])
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance, **kwargs):
+    update_counter(User, [instance.author_id], 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_variants(sender, instance, **kwargs):
+    if instance.image and not has_variants(instance):
+        schedule_variants(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe_fragment(sender, instance, created, **kwargs):
+    if not created:
+        recipe_fragment_cache.invalidate(recipe_ids=[instance.id])
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_ingredients_fragment(sender, instance, **kwargs):
+    recipe_fragment_cache.invalidate(recipe_ids=[instance.recipes_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_tags_fragment(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        recipe_fragment_cache.invalidate(recipe_ids=[instance.id])
+    elif pk_set is not None:
+        recipe_fragment_cache.invalidate(recipe_ids=pk_set)
+    else:
+        bump_version(Tag)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_fragments(sender, instance, created, update_fields=None,
+                                **kwargs):
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    recipe_fragment_cache.invalidate(author_ids=[instance.id])
@@ -0,0 +1,93 @@
+from django.test import TestCase
+
+from recipes.models import Favorite, Recipe, RecipeScore, Shopping_Cart
+from users.models import User, UserSubscribe
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@example.com', username=name,
+        first_name=name, last_name=name, password='password'
+    )
+
+
+def create_recipe(author, name='Рецепт'):
+    return Recipe.objects.create(
+        author=author, name=name, text='Описание',
+        image='media/test.png', cooking_time=10
+    )
+
+
+class CounterFieldsTest(TestCase):
+    """Обычный save() не затирает счетчики, измененные через F()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.user = create_user('user')
+        cls.recipe = create_recipe(cls.author)
+
+    def test_stale_recipe_keeps_counters(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.add(self.user, [recipe.id])
+        Shopping_Cart.objects.add(self.user, [recipe.id])
+        recipe.name = 'Новое название'
+        recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 1)
+
+    def test_stale_user_keeps_counters(self):
+        author = User.objects.get(pk=self.author.pk)
+        create_recipe(self.author, 'Второй рецепт')
+        UserSubscribe.objects.add(self.user, [author.id])
+        author.first_name = 'Автор'
+        author.save()
+        author.refresh_from_db()
+        self.assertEqual(author.first_name, 'Автор')
+        self.assertEqual(author.recipes_count, 2)
+        self.assertEqual(author.followers_count, 1)
+
+    def test_explicit_update_fields_write_counters(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.favorites_count = 5
+        recipe.save(update_fields=('favorites_count',))
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 5)
+
+
+class StaleScoresTest(TestCase):
+    """Рейтинг пересчитывается после любых изменений избранного."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.users = [create_user(f'user{index}') for index in range(2)]
+        cls.recipe = create_recipe(cls.author)
+
+    def assert_stale(self, stale):
+        self.assertEqual(
+            self.recipe.id in RecipeScore.objects.stale(), stale
+        )
+
+    def test_refreshed_recipe_is_fresh(self):
+        Favorite.objects.add(self.users[0], [self.recipe.id])
+        self.assert_stale(True)
+        RecipeScore.objects.refresh([self.recipe.id])
+        self.assert_stale(False)
+
+    def test_remove_and_add_between_refreshes(self):
+        Favorite.objects.add(self.users[0], [self.recipe.id])
+        RecipeScore.objects.refresh([self.recipe.id])
+        Favorite.objects.remove(self.users[0], [self.recipe.id])
+        Favorite.objects.add(self.users[1], [self.recipe.id])
+        self.assert_stale(True)
+        RecipeScore.objects.refresh([self.recipe.id])
+        self.assert_stale(False)
+
+    def test_remove_is_stale(self):
+        Shopping_Cart.objects.add(self.users[0], [self.recipe.id])
+        RecipeScore.objects.refresh([self.recipe.id])
+        Shopping_Cart.objects.remove(self.users[0], [self.recipe.id])
+        self.assert_stale(True)
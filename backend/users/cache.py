@@ -0,0 +1,107 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.constants import TOKEN_CACHE_SIZE
+from core.prometheus import record_cache
+from users.models import User
+
+
+def get_token_key(key):
+    """Ключ общего кэша; сам токен в имени ключа не хранится."""
+    return 'token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+class TokenCache:
+    """Снимки пользователей по ключу токена.
+
+    Снимок - только поля, которые читают аутентификация, права
+    и сериализаторы (SNAPSHOT_FIELDS). Хэш пароля в общий кэш
+    не попадает: остальные поля, включая счетчики вроде
+    recipes_count, отложены и при обращении читаются из базы.
+    Снимки хранятся в общем кэше TOKEN_CACHE_TIMEOUT секунд и в LRU
+    на TOKEN_CACHE_SIZE записей в памяти процесса
+    TOKEN_CACHE_LOCAL_TIMEOUT секунд: сброс из другого процесса
+    доходит до LRU не позже этого срока.
+    """
+
+    SNAPSHOT_FIELDS = ('id', 'email', 'username', 'first_name',
+                       'last_name', 'is_active', 'is_staff', 'is_superuser')
+
+    def __init__(self, size=TOKEN_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._counts = Counter()
+        self.size = size
+
+    @classmethod
+    def make_snapshot(cls, user):
+        # from_db ждет значения в порядке полей модели.
+        return {field.attname: getattr(user, field.attname)
+                for field in User._meta.concrete_fields
+                if field.attname in cls.SNAPSHOT_FIELDS}
+
+    @staticmethod
+    def make_user(snapshot):
+        return User.from_db('default', list(snapshot), list(snapshot.values()))
+
+    def _count(self, level, hit):
+        self._counts[level, hit] += 1
+        record_cache(f'token_{level}', hit)
+
+    def _remember(self, key, snapshot):
+        timeout = min(settings.TOKEN_CACHE_LOCAL_TIMEOUT,
+                      settings.TOKEN_CACHE_TIMEOUT)
+        if timeout <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + timeout, snapshot)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def get(self, key):
+        """Пользователь из снимка или None, если снимка нет."""
+        with self._lock:
+            expires, snapshot = self._items.get(key, (0, None))
+            if snapshot is not None and expires > time.monotonic():
+                self._items.move_to_end(key)
+                self._count('local', True)
+                return self.make_user(snapshot)
+            self._items.pop(key, None)
+            self._count('local', False)
+        snapshot = cache.get(get_token_key(key))
+        self._count('shared', snapshot is not None)
+        if snapshot is None:
+            return None
+        self._remember(key, snapshot)
+        return self.make_user(snapshot)
+
+    def set(self, key, user):
+        snapshot = self.make_snapshot(user)
+        cache.set(get_token_key(key), snapshot, settings.TOKEN_CACHE_TIMEOUT)
+        self._remember(key, snapshot)
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+        cache.delete_many([get_token_key(key) for key in keys])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                **{f'{level}_{"hits" if hit else "misses"}': count
+                   for (level, hit), count in sorted(self._counts.items())},
+            }
+
+
+token_cache = TokenCache()
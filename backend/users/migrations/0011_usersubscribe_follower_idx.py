@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usersubscribe',
+            index=models.Index(fields=['follower', '-pub_date'], name='usersubscribe_follower_idx'),
+        ),
+    ]
@@ -1,13 +1,42 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as DjangoUserManager
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import BooleanField, Exists, OuterRef, Value
+from django.utils import timezone
 
+from core.cache import invalidate_feeds
 from core.constants import LENGTH, LENGTH_EMAIL
+from core.counters import CounterFieldsMixin, update_counter
+from core.sql import delete_returning, insert_ignore
 
 
-class User(AbstractUser):
+class UserQuerySet(models.QuerySet):
+    """Набор запросов для пользователей."""
+
+    def with_is_subscribed(self, user):
+        """Аннотирует пользователей подпиской на них текущего user."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(is_subscribed=Exists(
+            UserSubscribe.objects.filter(
+                author=OuterRef('pk'),
+                follower=user
+            )
+        ))
+
+
+class UserManager(DjangoUserManager.from_queryset(UserQuerySet)):
+    """Менеджер пользователей с аннотациями для API."""
+
+
+class User(CounterFieldsMixin, AbstractUser):
     """Пользовательская модель."""
 
+    counter_fields = ('recipes_count', 'followers_count')
+
     email = models.EmailField(
         max_length=LENGTH_EMAIL,
         unique=True,
@@ -33,6 +62,18 @@ class User(AbstractUser):
         max_length=LENGTH,
         verbose_name='Пароль'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков'
+    )
+
+    objects = UserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
@@ -54,6 +95,37 @@ class User(AbstractUser):
         )
 
 
+class UserSubscribeQuerySet(models.QuerySet):
+    """Набор запросов для подписок."""
+
+    def add(self, follower, author_ids):
+        """Подписывает одним INSERT ... ON CONFLICT DO NOTHING.
+
+        Возвращает id авторов, на которых подписка действительно создана.
+        """
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            added = insert_ignore(self.model, [
+                {'author': author_id, 'follower': follower.id, 'pub_date': now}
+                for author_id in author_ids
+            ], 'author', self.db)
+            update_counter(User, added, 'followers_count', 1)
+        if added:
+            invalidate_feeds([follower.id])
+        return added
+
+    def remove(self, follower, author_ids):
+        """Отписывает одним DELETE, возвращает id авторов."""
+        with transaction.atomic(using=self.db):
+            removed = delete_returning(self.model, 'author', self.db,
+                                       follower=[follower.id],
+                                       author=author_ids)
+            update_counter(User, removed, 'followers_count', -1)
+        if removed:
+            invalidate_feeds([follower.id])
+        return removed
+
+
 class UserSubscribe(models.Model):
     """Модель для подписок."""
 
@@ -74,6 +146,8 @@ class UserSubscribe(models.Model):
         auto_now_add=True
     )
 
+    objects = UserSubscribeQuerySet.as_manager()
+
     class Meta:
 
         verbose_name = 'Пользовательскую подписку'
@@ -82,6 +156,10 @@ class UserSubscribe(models.Model):
             models.UniqueConstraint(fields=('author', 'follower', ),
                                     name='unique_follow'),
         )
+        indexes = (
+            models.Index(fields=('follower', '-pub_date'),
+                         name='usersubscribe_follower_idx'),
+        )
         ordering = ['-pub_date']
 
     def __str__(self):
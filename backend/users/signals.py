@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core.cache import invalidate_feeds
+from core.counters import update_counter
+from users.cache import token_cache
+from users.models import User, UserSubscribe
+
+
+@receiver(post_save, sender=UserSubscribe)
+def increase_followers_count(sender, instance, created, **kwargs):
+    if created:
+        update_counter(User, [instance.author_id], 'followers_count', 1)
+
+
+@receiver(post_delete, sender=UserSubscribe)
+def decrease_followers_count(sender, instance, **kwargs):
+    update_counter(User, [instance.author_id], 'followers_count', -1)
+
+
+@receiver((post_save, post_delete), sender=UserSubscribe)
+def invalidate_follower_feed(sender, instance, **kwargs):
+    invalidate_feeds([instance.follower_id])
+
+
+def invalidate_tokens_on_commit(keys):
+    # До фиксации параллельный запрос прочитал бы старого пользователя
+    # и снова закэшировал его на весь TOKEN_CACHE_TIMEOUT.
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: token_cache.invalidate(keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens_on_commit([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_tokens_on_commit(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from users.cache import TokenCache, get_token_key, token_cache
+from users.models import User
+
+
+@override_settings(TOKEN_CACHE_TIMEOUT=300)
+class TokenCacheTest(TestCase):
+    """Снимки пользователей в кэше токенов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.invalidate([self.token.key])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_snapshot_has_no_password(self):
+        self.client.get('/api/users/me/')
+        snapshot = cache.get(get_token_key(self.token.key))
+        self.assertEqual(set(snapshot), set(TokenCache.SNAPSHOT_FIELDS))
+        self.assertNotIn('password', snapshot)
+
+    def test_cached_user(self):
+        self.client.get('/api/users/me/')
+        user = TokenCache().get(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.email, self.user.email)
+        self.assertTrue(user.is_active)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertTrue(user.check_password('password'))
+
+    def test_set_password_with_cached_user(self):
+        self.client.get('/api/users/me/')
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'password', 'new_password': 'N3w-passw0rd!'
+        })
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('N3w-passw0rd!'))
+
+    def test_invalidated_after_commit(self):
+        self.client.get('/api/users/me/')
+        key = get_token_key(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            self.assertIsNotNone(cache.get(key))
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+class TokenCacheSettingsTest(TestCase):
+
+    def test_disabled_without_shared_cache(self):
+        if not settings.SHARED_CACHE:
+            self.assertEqual(settings.TOKEN_CACHE_TIMEOUT, 0)